@@ -0,0 +1,148 @@
+"""
+LoRa Time on Air and Duty Cycle Budget
+"""
+import threading
+from dataclasses import dataclass
+from enum import Enum, auto
+from math import ceil
+from time import monotonic
+from typing import Callable
+
+
+# MHDR (1) + FHDR without options (7) + FPort (1) + MIC (4) around the application payload
+LORAWAN_OVERHEAD = 13
+
+
+class Priority(Enum):
+    ROUTINE = auto()  # may not use the reserve kept for alerts
+    ALERT = auto()
+
+
+@dataclass(frozen=True)
+class RadioSettings:
+    spreading_factor: int = 7
+    bandwidth: int = 125000  # Hz
+    coding_rate: int = 1     # 1 to 4 for 4/5 to 4/8
+    preamble: int = 8
+    explicit_header: bool = True
+    crc: bool = True
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'RadioSettings':
+        return cls(
+            spreading_factor=config.get('spreadingfactor', cls.spreading_factor),
+            bandwidth=config.get('bandwidth', cls.bandwidth),
+            coding_rate=config.get('codingrate', cls.coding_rate),
+            preamble=config.get('preamble', cls.preamble),
+        )
+
+
+def time_on_air(payload_length: int, radio: RadioSettings) -> float:
+    """ Time on air of a LoRa frame (Semtech AN1200.13).
+
+    Args:
+        payload_length: `int` PHY payload length in bytes.
+        radio: `RadioSettings` the frame is sent with.
+    Returns:
+        `float` seconds the radio transmits.
+    Example:
+        >>> round(time_on_air(24, RadioSettings()), 4)
+        0.0617
+    """
+    sf = radio.spreading_factor
+    symbol_time = (2 ** sf) / radio.bandwidth
+    low_data_rate = 1 if symbol_time >= 0.016 else 0  # mandated for SF11 and SF12 at 125 kHz
+    implicit_header = 0 if radio.explicit_header else 1
+
+    numerator = 8 * payload_length - 4 * sf + 28 + 16 * radio.crc - 20 * implicit_header
+    payload_symbols = 8 + max(ceil(numerator / (4 * (sf - 2 * low_data_rate))) * (radio.coding_rate + 4), 0)
+    preamble_time = (radio.preamble + 4.25) * symbol_time
+    return preamble_time + payload_symbols * symbol_time
+
+
+def uplink_airtime(payload: str, radio: RadioSettings) -> float:
+    """Time on air of an `AT+CMSG`/`AT+MSG` text payload once wrapped in a LoRaWAN frame"""
+    return time_on_air(LORAWAN_OVERHEAD + len(payload.encode('ascii')), radio)
+
+
+class AirtimeBudget:
+    """Token bucket of airtime seconds.
+
+    The bucket holds `duty_cycle * window` seconds and refills at `duty_cycle` seconds per second, so
+    any `window` never exceeds the duty cycle. `ROUTINE` frames leave `alert_reserve` of the bucket
+    untouched so that alerts still go out when routine traffic has used up its share.
+    """
+
+    def __init__(self, duty_cycle: float = 0.01, window: float = 3600.0, alert_reserve: float = 0.2,
+                 clock: Callable[[], float] = monotonic):
+        self.duty_cycle = duty_cycle
+        self.capacity = duty_cycle * window
+        self.reserve = alert_reserve * self.capacity
+        self.clock = clock
+
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.sent = 0
+        self.deferrals = 0
+        self.dropped = 0  # deferred routine frames replaced by a newer one before they were sent
+        self.consumed = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, clock: Callable[[], float] = monotonic) -> 'AirtimeBudget':
+        return cls(
+            duty_cycle=config.get('dutycycle', 0.01),
+            window=config.get('window', 3600.0),
+            alert_reserve=config.get('alertreserve', 0.2),
+            clock=clock,
+        )
+
+    def try_consume(self, airtime: float, priority: Priority = Priority.ROUTINE) -> bool:
+        """Takes `airtime` seconds out of the bucket if the priority allows it"""
+        with self._lock:
+            self._refill()
+            if self.tokens - airtime < self._floor(priority):
+                return False
+            self.tokens -= airtime
+            self.sent += 1
+            self.consumed += airtime
+            return True
+
+    def time_until(self, airtime: float, priority: Priority = Priority.ROUTINE) -> float:
+        """Seconds until `try_consume` can succeed for a frame of `airtime` seconds"""
+        with self._lock:
+            self._refill()
+            missing = airtime + self._floor(priority) - self.tokens
+            return max(0.0, missing / self.duty_cycle)
+
+    def defer(self):
+        with self._lock:
+            self.deferrals += 1
+
+    def drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    @property
+    def remaining(self) -> float:
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+    def metrics(self) -> dict:
+        return {
+            'remaining': round(self.remaining, 3),
+            'capacity': self.capacity,
+            'sent': self.sent,
+            'deferrals': self.deferrals,
+            'dropped': self.dropped,
+            'consumed': round(self.consumed, 3),
+        }
+
+    def _floor(self, priority: Priority) -> float:
+        return self.reserve if priority == Priority.ROUTINE else 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.duty_cycle)
+        self.updated = now
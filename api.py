@@ -0,0 +1,101 @@
+"""
+Local Read API for the Latest Readings
+"""
+import json
+import math
+import threading
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+
+API_HOST = '127.0.0.1'  # station-local consumers only
+
+
+class ReadingCache:
+    """The most recent `size` readings, kept as an immutable snapshot.
+
+    The single writer (the acquisition loop) builds a new tuple and swaps the reference, readers only
+    ever read the reference, so neither side takes a lock and a slow reader cannot stall sampling.
+    Each reading is a tuple of its POSIX timestamp followed by one value per channel, `None` for
+    missing data and for NaN or infinite values (the ring stores nulls as NaN), which JSON cannot carry.
+    """
+
+    def __init__(self, size: int, channels: list[str]):
+        self.size = size
+        self.channels = channels
+        self.snapshot: tuple[tuple, ...] = ()
+
+    def append(self, timestamp: float, values: list[Optional[float]]):
+        start = max(0, len(self.snapshot) - self.size + 1)
+        values = [value if value is None or math.isfinite(value) else None for value in values]
+        self.snapshot = self.snapshot[start:] + ((timestamp, *values),)
+
+    def latest(self) -> list[tuple]:
+        return list(self.snapshot[-1:])
+
+    def last(self, n: int) -> list[tuple]:
+        return list(self.snapshot[-n:]) if n > 0 else []
+
+    def since(self, timestamp: float) -> list[tuple]:
+        """Readings strictly after `timestamp`, readings are appended in time order"""
+        snapshot = self.snapshot
+        return list(snapshot[bisect_right(snapshot, timestamp, key=lambda reading: reading[0]):])
+
+
+class _ReadingRequestHandler(BaseHTTPRequestHandler):
+    server: 'ReadingServer'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        cache = self.server.cache
+        try:
+            if url.path == '/latest':
+                readings = cache.latest()
+            elif url.path == '/last':
+                readings = cache.last(int(query.get('n', ['1'])[0]))
+            elif url.path == '/since':
+                readings = cache.since(float(query['t'][0]))
+            else:
+                self.send_error(404)
+                return
+        except (KeyError, ValueError):
+            self.send_error(400, 'Expected /latest, /last?n=<count> or /since?t=<timestamp>')
+            return
+
+        body = json.dumps({'channels': cache.channels, 'readings': readings}, separators=(',', ':'),
+                          allow_nan=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would flood the service log
+
+
+class ReadingServer(ThreadingHTTPServer):
+    """Serves a `ReadingCache` as compact JSON on localhost, one daemon thread per client.
+
+    `GET /latest`, `GET /last?n=10` and `GET /since?t=<POSIX timestamp>` return
+    `{"channels": [...], "readings": [[timestamp, value, ...], ...]}` with nulls for missing data.
+    """
+    daemon_threads = True
+
+    def __init__(self, cache: ReadingCache, port: int, host: str = API_HOST):
+        super().__init__((host, port), _ReadingRequestHandler)
+        self.cache = cache
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='api', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,200 @@
+"""
+Compact Binary Daily Archive of the Data Log
+"""
+import csv
+import math
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+from typing import Iterator, Optional
+
+from data import _DataFormat
+
+try:
+    import numpy as np
+except ImportError:  # the record iterator does not need it
+    np = None
+
+
+ARCHIVE_MAGIC = b'PDAR'
+ARCHIVE_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHqII')  # magic, version, channels, base POSIX time, records, record size
+_CHANNEL = struct.Struct('<16sb')    # name, decimals of the fixed-point value
+
+MAX_DECIMALS = 4  # keeps an int32 above 200000 units, e.g. years of accumulated rain in mm
+MAX_CHANNELS = 32
+INT32_LIMIT = 2 ** 31 - 1
+
+
+def get_decimals(data_format: _DataFormat) -> int:
+    """Decimals stored for a channel, those of its payload format up to `MAX_DECIMALS`"""
+    return min(int(data_format.split('.')[1]), MAX_DECIMALS)
+
+
+def get_archive_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + '.bin'
+
+
+_MASK_DTYPES = {'B': '<u1', 'H': '<u2', 'I': '<u4'}
+
+
+def _mask_format(channels: int) -> str:
+    """Smallest unsigned integer with a bit per channel"""
+    return 'B' if channels <= 8 else 'H' if channels <= 16 else 'I'
+
+
+def _record_format(channels: int) -> str:
+    """Offset from the base time in seconds, one fixed-point value per channel and the null mask"""
+    return '<i%di%s' % (channels, _mask_format(channels))
+
+
+def write_archive(path: str, channels: list[tuple[str, int]], rows: list[tuple[datetime, list[Optional[float]]]]):
+    """ Writes readings as a fixed-record archive, replacing `path` atomically.
+
+    Args:
+        path: `str` of the archive.
+        channels: `list` of the name and decimals of every channel.
+        rows: `list` of the timestamp and values of every reading, `None` for missing data. Values that
+            are not finite or do not fit an int32 once scaled are stored as missing too.
+    Raises:
+        `ValueError` if there are more than `MAX_CHANNELS` channels.
+    """
+    if len(channels) > MAX_CHANNELS:
+        raise ValueError('An archive holds at most %d channels' % MAX_CHANNELS)
+    record = struct.Struct(_record_format(len(channels)))
+    first = rows[0][0] if rows else datetime.now()
+    base = int(datetime(first.year, first.month, first.day).timestamp())
+    factors = [10 ** decimals for _, decimals in channels]
+
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(channels), base, len(rows), record.size))
+            for name, decimals in channels:
+                f.write(_CHANNEL.pack(name.encode('utf-8')[:16], decimals))
+            for timestamp, values in rows:
+                fixed, mask = [], 0
+                for i, (value, factor) in enumerate(zip(values, factors)):
+                    # a float32 register can decode to inf or NaN, which have no fixed-point value
+                    scaled = round(value * factor) if value is not None and math.isfinite(value) else None
+                    if scaled is None or abs(scaled) > INT32_LIMIT:
+                        fixed.append(0)
+                        mask |= 1 << i
+                        continue
+                    fixed.append(scaled)
+                f.write(record.pack(round(timestamp.timestamp()) - base, *fixed, mask))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_csv_log(csv_path: str, channels: int) -> list[tuple[datetime, list[Optional[float]]]]:
+    """Rows of a data log written by `CompiledSensorData.get_csv_format`, missing values are `None`"""
+    rows = []
+    with open(csv_path, newline='') as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            values = [float(value) if value else None for value in row[1:channels + 1]]
+            rows.append((datetime.fromisoformat(row[0]), values + [None] * (channels - len(values))))
+    return rows
+
+
+def archive_csv_log(csv_path: str, channels: list[tuple[str, int]], keep_csv: bool = False) -> str:
+    """Converts a rotated data log to an archive next to it, returns the archive path"""
+    archive_path = get_archive_path(csv_path)
+    write_archive(archive_path, channels, read_csv_log(csv_path, len(channels)))
+    if not keep_csv:
+        os.remove(csv_path)
+    return archive_path
+
+
+class Archive:
+    """Memory-mapped reader of an archive.
+
+    `records` is a NumPy structured view of the records (`offset`, `values`, `mask`) straight on the
+    mapping, nothing is read until it is indexed. `timestamps()` and `values()` build float arrays from
+    it, with NaN for missing values. Without NumPy, iterating yields `(datetime, values)` per record.
+    Views into the mapping have to be released before `close()`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, channels, self.base, records, record_size = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic, version = b'', 0
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self._mmap.close()
+            raise ValueError('%s is not a version %d archive' % (path, ARCHIVE_VERSION))
+        self._record = struct.Struct(_record_format(channels))
+        if record_size != self._record.size:
+            self._mmap.close()
+            raise ValueError('%s has %d byte records, expected %d' % (path, record_size, self._record.size))
+
+        self.channels: list[str] = []
+        self.decimals: list[int] = []
+        for i in range(channels):
+            name, decimals = _CHANNEL.unpack_from(self._mmap, _HEADER.size + i * _CHANNEL.size)
+            self.channels.append(name.rstrip(b'\0').decode('utf-8'))
+            self.decimals.append(decimals)
+        self._start = _HEADER.size + channels * _CHANNEL.size
+        # a truncated file still reads up to its last complete record
+        self.count = min(records, (len(self._mmap) - self._start) // record_size)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> 'Archive':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self) -> Iterator[tuple[datetime, list[Optional[float]]]]:
+        record = self._record
+        for position in range(self._start, self._start + self.count * record.size, record.size):
+            offset, *fixed, mask = record.unpack_from(self._mmap, position)
+            values = [None if mask >> i & 1 else value / 10 ** decimals
+                      for i, (value, decimals) in enumerate(zip(fixed, self.decimals))]
+            yield datetime.fromtimestamp(self.base + offset), values
+
+    @property
+    def records(self):
+        if np is None:
+            raise RuntimeError('numpy is needed for array views, iterate over the archive instead')
+        dtype = np.dtype([('offset', '<i4'), ('values', '<i4', (len(self.channels),)),
+                          ('mask', _MASK_DTYPES[_mask_format(len(self.channels))])])
+        return np.frombuffer(self._mmap, dtype=dtype, count=self.count, offset=self._start)
+
+    def timestamps(self):
+        """POSIX timestamps of the records"""
+        return self.records['offset'] + float(self.base)
+
+    def values(self, channel: str):
+        """Values of a channel, NaN where missing"""
+        i = self.channels.index(channel)
+        records = self.records
+        values = records['values'][:, i] / 10 ** self.decimals[i]
+        values[(records['mask'] >> i) & 1 == 1] = np.nan
+        return values
+
+    def close(self):
+        self._mmap.close()
+
+
+if __name__ == '__main__':
+    # python archive.py data_log_01-15-24.csv ..., converts rotated data logs and keeps the CSV files
+    from main import ARCHIVE_CHANNELS
+
+    for csv_path in sys.argv[1:]:
+        print(archive_csv_log(csv_path, ARCHIVE_CHANNELS, keep_csv=True))
@@ -0,0 +1,70 @@
+"""
+Write Cost and Query Latency of the CSV and SQLite Storage Backends
+
+Usage: python benchmarks/bench_storage.py [days]
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import CompiledSensorData, DataSource, RawData, SensorData, FLOOD_FORMAT, RAIN_DATA_FORMAT, \
+    RAIN_ACCU_FORMAT  # noqa: E402
+from generics import get_last_n_rows_csv  # noqa: E402
+from storage import CsvStorage, SqliteStorage  # noqa: E402
+
+
+COLUMNS = [('DSG', 0), ('DRRG', 0), ('DRRG', 1)]
+READINGS_PER_DAY = 1440  # one per minute
+
+
+def make_payload(now: datetime, i: int) -> CompiledSensorData:
+    return CompiledSensorData([
+        SensorData(DataSource.DIGITAL_STAFF_GAUGE, 'cm', now, [RawData(FLOOD_FORMAT, float(i % 500))]),
+        SensorData(DataSource.DIGITAL_RAIN_GAUGE, 'mm', now,
+                   [RawData(RAIN_DATA_FORMAT, (i % 7) / 4), RawData(RAIN_ACCU_FORMAT, i / 100)]),
+    ])
+
+
+def timed(function, *args) -> float:
+    start = perf_counter()
+    function(*args)
+    return perf_counter() - start
+
+
+def main(days: int = 7):
+    start = datetime(2025, 1, 1)
+    readings = [(start + timedelta(minutes=i), i) for i in range(days * READINGS_PER_DAY)]
+    window = (start + timedelta(days=days - 1), start + timedelta(days=days - 1, hours=1))
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_storage = CsvStorage(os.path.join(directory, 'data_log.csv'))
+        sqlite_storage = SqliteStorage(os.path.join(directory, 'data_log.sqlite'), COLUMNS)
+
+        def write_all(storage):
+            for now, i in readings:
+                storage.write(now, make_payload(now, i))
+
+        def write_and_commit(storage):
+            write_all(storage)
+            storage.flush()
+
+        csv_write = timed(write_all, csv_storage)
+        sqlite_write = timed(write_and_commit, sqlite_storage)
+
+        # the CSV log can only be scanned, the last hour stands in for a time range query
+        csv_query = timed(get_last_n_rows_csv, csv_storage.path, 60)
+        sqlite_query = timed(sqlite_storage.query, *window)
+        sqlite_storage.close()
+
+        print('%d readings over %d days' % (len(readings), days))
+        print('%-8s %14s %14s' % ('', 'write/reading', 'query 1 hour'))
+        print('%-8s %12.1fus %12.2fms' % ('csv', csv_write / len(readings) * 1e6, csv_query * 1e3))
+        print('%-8s %12.1fus %12.2fms' % ('sqlite', sqlite_write / len(readings) * 1e6, sqlite_query * 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,192 @@
+"""
+Burst Oversampling with Median and MAD Outlier Filtering
+"""
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+from data import DataSource, RawData, SensorData, _DataFormat
+
+
+MAD_SIGMA = 1.4826  # MAD to standard deviation for normally distributed noise
+
+
+def get_resolution(data_format: _DataFormat) -> float:
+    """Smallest step a channel reports, from the decimals of its payload format"""
+    return 10.0 ** -int(data_format.split('.')[1])
+
+
+class RunningMedian:
+    """Samples kept sorted as they arrive: `add` is a binary search and an insert, `median` is O(1).
+
+    `mad` walks the deviations below and above the median, which are both already sorted, so it
+    needs no second sort. `window(low, high)` is the samples within `[low, high]`, again sorted.
+    """
+
+    def __init__(self, values: Optional[list[float]] = None):
+        self.values = sorted(values or [])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, value: float):
+        insort(self.values, value)
+
+    def median(self) -> float:
+        values, middle = self.values, len(self.values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+
+    def mad(self) -> float:
+        """Median absolute deviation from the median"""
+        n = len(self.values)
+        if n % 2:
+            return self._deviation(n // 2)
+        return (self._deviation(n // 2 - 1) + self._deviation(n // 2)) / 2
+
+    def window(self, low: float, high: float) -> 'RunningMedian':
+        window = RunningMedian()
+        window.values = self.values[bisect_left(self.values, low):bisect_right(self.values, high)]
+        return window
+
+    def _deviation(self, k: int) -> float:
+        """The `k`th smallest absolute deviation, merging the two sorted runs around the median"""
+        values, median = self.values, self.median()
+        below = bisect_left(values, median) - 1  # deviations grow going down from here
+        above = below + 1                        # and going up from here
+        while True:
+            low = median - values[below] if below >= 0 else None
+            high = values[above] - median if above < len(values) else None
+            if high is None or (low is not None and low <= high):
+                deviation, below = low, below - 1
+            else:
+                deviation, above = high, above + 1
+            if k == 0:
+                return deviation
+            k -= 1
+
+
+@dataclass(frozen=True)
+class BurstSettings:
+    samples: int = 1       # reads per sensor and tick, 1 turns bursts off
+    window: float = 0.0    # seconds the reads are spread over, 0 reads them back to back
+    threshold: float = 3.0  # samples further than this many MAD sigmas from the median are outliers
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'BurstSettings':
+        return cls(
+            samples=int(config.get('samples', 1)),
+            window=float(config.get('window', 0.0)),
+            threshold=float(config.get('threshold', 3.0)),
+        )
+
+
+@dataclass
+class BurstStats:
+    source: DataSource
+    attempts: int          # reads tried
+    accepted: int          # reads that passed the length/CRC checks, less the outliers of the worst channel
+    spread: list[Optional[float]]  # MAD sigma of the accepted samples of every channel
+
+    @property
+    def quality(self) -> float:
+        return self.accepted / self.attempts if self.attempts else 0.0
+
+
+class BurstAccumulator:
+    """Collects the samples of one sensor during a burst, one `RunningMedian` per channel"""
+
+    def __init__(self, source: DataSource):
+        self.source = source
+        self.attempts = 0
+        self.failures = 0  # reads that failed the length or CRC checks
+        self.first: Optional[SensorData] = None
+        self.channels: list[RunningMedian] = []
+
+    def add(self, data: SensorData, has_error: bool):
+        self.attempts += 1
+        if has_error:
+            self.failures += 1
+            return
+        if self.first is None:
+            self.first = data
+            self.channels = [RunningMedian() for _ in data.data]
+        for channel, raw_data in zip(self.channels, data.data):
+            if raw_data.datum is not None:
+                channel.add(raw_data.datum)
+
+    def result(self, threshold: float) -> Optional[tuple[SensorData, BurstStats]]:
+        """ Median of every channel once the outliers are rejected.
+
+        The limit is never below the resolution of the channel, so when most samples agree exactly a
+        sample one step away, e.g. 1 cm on the staff gauge, is not an outlier.
+
+        Args:
+            threshold: `float` MAD sigmas from the median beyond which a sample is rejected.
+        Returns:
+            `tuple` of the `SensorData`, in the layout of the first good read, and its `BurstStats`,
+            `None` when every read failed.
+        """
+        if self.first is None:
+            return None
+        values, spread, accepted = [], [], self.attempts - self.failures
+        for channel, raw_data in zip(self.channels, self.first.data):
+            if not channel:
+                values.append(None)
+                spread.append(None)
+                continue
+            median = channel.median()
+            limit = max(threshold * MAD_SIGMA * channel.mad(), get_resolution(raw_data.format))
+            kept = channel.window(median - limit, median + limit)
+            accepted = min(accepted, len(kept))
+            values.append(kept.median())
+            spread.append(MAD_SIGMA * kept.mad())
+        data = SensorData(
+            source=self.source,
+            unit=self.first.unit,
+            date=self.first.date,
+            data=[RawData(format=raw_data.format, datum=value) for raw_data, value in zip(self.first.data, values)]
+        )
+        return data, BurstStats(self.source, self.attempts, accepted, spread)
+
+
+def read_burst(reads: dict[DataSource, Callable[[], tuple[SensorData, bool]]], settings: BurstSettings,
+               clock: Callable[[], float] = monotonic, wait: Callable[[float], None] = sleep
+               ) -> dict[DataSource, BurstAccumulator]:
+    """ Reads every sensor `settings.samples` times within `settings.window` seconds.
+
+    The sensors are on their own ports, so each is read by its own thread and a slow sensor does not
+    hold up the others. The reads of a sensor are spread evenly over the window, those that would
+    start after it are dropped, so a silent sensor shortens its burst instead of lengthening the tick.
+
+    Args:
+        reads: `dict` of a reader without arguments per sensor, returning `(SensorData, has_error)`.
+        settings: `BurstSettings` of the burst.
+    Returns:
+        `dict` of the `BurstAccumulator` of every sensor.
+    """
+    accumulators = {source: BurstAccumulator(source) for source in reads}
+    if not reads:
+        return accumulators
+    start = clock()
+    with ThreadPoolExecutor(max_workers=len(reads), thread_name_prefix='burst') as executor:
+        futures = [executor.submit(_read_slots, read, accumulators[source], settings, start, clock, wait)
+                   for source, read in reads.items()]
+        for future in futures:
+            future.result()  # a serial error is raised here, as with a single read
+    return accumulators
+
+
+def _read_slots(read: Callable[[], tuple[SensorData, bool]], accumulator: BurstAccumulator,
+                settings: BurstSettings, start: float, clock: Callable[[], float], wait: Callable[[float], None]):
+    for slot in range(settings.samples):
+        slot_start = start + slot * settings.window / settings.samples
+        now = clock()
+        if slot and settings.window and now - start >= settings.window:  # no window, back to back
+            break
+        if slot_start > now:
+            wait(slot_start - now)
+        accumulator.add(*read())
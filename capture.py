@@ -0,0 +1,279 @@
+"""
+Raw Modbus Frame Capture and Offline Decoding
+"""
+import struct
+import sys
+from dataclasses import dataclass
+from time import time
+from typing import Optional
+
+from crccheck.crc import Crc16Modbus
+
+from configs import DRRG_COMM_0, DSG_COMM_0
+from data import DataSource
+
+try:
+    import numpy as np
+except ImportError:  # the struct decoder gives the same result, one frame at a time
+    np = None
+
+
+CAPTURE_MAGIC = b'PMFC'
+CAPTURE_VERSION = 1
+
+_HEADER = struct.Struct('<4sH')   # magic, version
+_RECORD = struct.Struct('<dBBH')  # POSIX timestamp, source id, direction, frame length; the frame follows
+
+REQUEST, RESPONSE = 0, 1
+
+SOURCE_IDS = {
+    DataSource.DIGITAL_STAFF_GAUGE: 1,
+    DataSource.DIGITAL_RAIN_GAUGE: 2,
+}
+
+# byte positions, in big-endian order, of a float32 sent in the given word/byte order
+WORD_ORDERS = {
+    'ABCD': (0, 1, 2, 3),
+    'CDAB': (2, 3, 0, 1),  # low word first, what the DRRG sends
+    'BADC': (1, 0, 3, 2),
+    'DCBA': (3, 2, 1, 0),
+}
+
+# register types as `struct` and `numpy` formats, Modbus registers are big-endian
+_STRUCT_TYPES = {'uint16': '>H', 'int16': '>h', 'float32': '>f'}
+_NUMPY_TYPES = {'uint16': '>u2', 'int16': '>i2', 'float32': '>f4'}
+
+MODBUS_HEADER = 3  # slave id, function code and byte count before the register data
+
+
+@dataclass(frozen=True)
+class RegisterField:
+    name: str
+    register: int  # offset from the first register of the read
+    type: str      # 'uint16', 'int16' or 'float32'
+    word_order: str = 'ABCD'
+
+    @property
+    def offset(self) -> int:
+        return MODBUS_HEADER + 2 * self.register
+
+
+@dataclass(frozen=True)
+class ResponseLayout:
+    request: bytes  # only the responses to this request are decoded with the layout
+    length: int     # of a complete response, CRC included
+    fields: tuple[RegisterField, ...]
+
+
+# responses to the legacy `configs.DSG_COMM_0` (2 registers) and `configs.DRRG_COMM_0` (16 registers),
+# the reads planned from a register map have their own, see `registers.ReadPlan.layout`
+RESPONSE_LAYOUTS = {
+    DataSource.DIGITAL_STAFF_GAUGE: ResponseLayout(DSG_COMM_0, 9, (RegisterField('water_level', 0, 'uint16'),)),
+    DataSource.DIGITAL_RAIN_GAUGE: ResponseLayout(DRRG_COMM_0, 37, (RegisterField('rain', 12, 'float32', 'CDAB'),
+                                                                    RegisterField('rain_accu', 14, 'float32', 'CDAB'))),
+}
+
+
+class FrameCapture:
+    """Appends every request/response frame with its timestamp to a binary capture file.
+
+    The file starts with `CAPTURE_MAGIC` and the version, then holds one `_RECORD` header followed by
+    the frame bytes per frame. Every exchange is flushed, a power loss at most truncates the last one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+
+    def record(self, timestamp: float, source: DataSource, request: bytes, response: bytes):
+        source_id = SOURCE_IDS[source]
+        self.file.write(_RECORD.pack(timestamp, source_id, REQUEST, len(request)) + request
+                        + _RECORD.pack(timestamp, source_id, RESPONSE, len(response)) + response)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CapturingPort:
+    """Serial port wrapper that records every request written and the response read after it"""
+
+    def __init__(self, port, capture: FrameCapture, source: DataSource):
+        self.port = port
+        self.capture = capture
+        self.source = source
+        self._request = b''
+        self._sent_at = 0.0
+
+    def write(self, data: bytes):
+        self._request = bytes(data)
+        self._sent_at = time()
+        return self.port.write(data)
+
+    def readline(self) -> bytes:
+        return self._record(self.port.readline())
+
+    def read(self, size: int = 1) -> bytes:
+        return self._record(self.port.read(size))
+
+    def _record(self, response: bytes) -> bytes:
+        self.capture.record(self._sent_at, self.source, self._request, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+@dataclass
+class FrameIndex:
+    """Where every frame of a capture is, frames are `data[offsets[i]:offsets[i] + lengths[i]]`"""
+    data: bytes
+    timestamps: list[float]
+    sources: list[int]
+    directions: list[int]
+    offsets: list[int]
+    lengths: list[int]
+
+
+def index_capture(data: bytes) -> FrameIndex:
+    """ Reads the record headers of a capture, a truncated last record is dropped.
+
+    Raises:
+        `ValueError` if `data` is not a capture.
+    """
+    magic, version = _HEADER.unpack_from(data) if len(data) >= _HEADER.size else (b'', 0)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError('Not a version %d frame capture' % CAPTURE_VERSION)
+    index = FrameIndex(data, [], [], [], [], [])
+    position = _HEADER.size
+    while position + _RECORD.size <= len(data):
+        timestamp, source, direction, length = _RECORD.unpack_from(data, position)
+        position += _RECORD.size
+        if position + length > len(data):
+            break
+        index.timestamps.append(timestamp)
+        index.sources.append(source)
+        index.directions.append(direction)
+        index.offsets.append(position)
+        index.lengths.append(length)
+        position += length
+    return index
+
+
+@dataclass
+class DecodedCapture:
+    """Channels of one sensor's responses, `numpy` arrays when it is installed, `list`s otherwise.
+
+    Responses that are truncated, fail the CRC or carry a Modbus exception are kept with NaN channels
+    and `valid` false, so the timestamps still show every poll.
+    """
+    timestamps: list
+    valid: list
+    channels: dict
+
+
+def decode_capture(data: bytes, source: DataSource, word_order: Optional[str] = None,
+                   layout: Optional[ResponseLayout] = None) -> DecodedCapture:
+    """ Decodes every response of a sensor to one request in a capture.
+
+    Args:
+        data: `bytes` of the capture file.
+        source: `DataSource` whose responses are decoded.
+        word_order: `str` key of `WORD_ORDERS` that overrides the order of every float32 field.
+        layout: `ResponseLayout` of the request, the legacy one in `RESPONSE_LAYOUTS` when `None`.
+    Returns:
+        `DecodedCapture` with one channel per field.
+    """
+    index = index_capture(data)
+    layout = layout or RESPONSE_LAYOUTS[source]
+    fields = layout.fields
+    if word_order is not None:
+        fields = tuple(RegisterField(field.name, field.register, field.type, word_order) for field in fields)
+    source_id = SOURCE_IDS[source]
+    selected = [i for i in range(1, len(index.offsets))
+                if index.sources[i] == source_id and index.directions[i] == RESPONSE
+                and index.directions[i - 1] == REQUEST and _frame(index, i - 1) == layout.request]
+    decode = _decode_numpy if np is not None else _decode_struct
+    return decode(index, selected, ResponseLayout(layout.request, layout.length, fields))
+
+
+def _frame(index: FrameIndex, i: int) -> bytes:
+    return index.data[index.offsets[i]:index.offsets[i] + index.lengths[i]]
+
+
+def _decode_numpy(index: FrameIndex, selected: list[int], layout: ResponseLayout):
+    length = layout.length
+    # padded so that a short last frame can be gathered like the others, it is masked out anyway
+    buffer = np.frombuffer(index.data + bytes(length), dtype=np.uint8)
+    offsets = np.array([index.offsets[i] for i in selected], dtype=np.int64)
+    lengths = np.array([index.lengths[i] for i in selected], dtype=np.int64)
+    complete = lengths == length
+
+    frames = buffer[offsets[:, None] + np.arange(length)]  # one gather, a row per frame
+    valid = complete & (_crc16_modbus(frames) == 0) & (frames[:, 1] == layout.request[1])
+
+    channels = {}
+    for field in layout.fields:
+        if field.type == 'float32':
+            raw = frames[:, field.offset + np.array(WORD_ORDERS[field.word_order])]
+        else:
+            raw = frames[:, field.offset:field.offset + 2]
+        values = np.ascontiguousarray(raw).view(_NUMPY_TYPES[field.type])[:, 0].astype(np.float64)
+        channels[field.name] = np.where(valid, values, np.nan)
+    timestamps = np.array([index.timestamps[i] for i in selected], dtype=np.float64)
+    return DecodedCapture(timestamps, valid, channels)
+
+
+_CRC_TABLE = []
+for _byte in range(256):
+    _crc = _byte
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0xA001 if _crc & 1 else _crc >> 1
+    _CRC_TABLE.append(_crc)
+
+
+def _crc16_modbus(frames):
+    """CRC-16/MODBUS of every row, zero when the row ends with its own valid CRC"""
+    table = np.array(_CRC_TABLE, dtype=np.uint16)
+    crc = np.full(len(frames), 0xFFFF, dtype=np.uint16)
+    for column in range(frames.shape[1]):
+        crc = (crc >> 8) ^ table[(crc ^ frames[:, column]) & 0xFF]
+    return crc
+
+
+def _decode_struct(index: FrameIndex, selected: list[int], layout: ResponseLayout):
+    timestamps, valid, channels = [], [], {field.name: [] for field in layout.fields}
+    for i in selected:
+        frame = _frame(index, i)
+        ok = len(frame) == layout.length and frame[1] == layout.request[1] and Crc16Modbus.calc(frame) == 0
+        timestamps.append(index.timestamps[i])
+        valid.append(ok)
+        for field in layout.fields:
+            if not ok:
+                channels[field.name].append(float('nan'))
+            elif field.type == 'float32':
+                ordered = bytes(frame[field.offset + position] for position in WORD_ORDERS[field.word_order])
+                channels[field.name].append(struct.unpack('>f', ordered)[0])
+            else:
+                [value] = struct.unpack_from(_STRUCT_TYPES[field.type], frame, field.offset)
+                channels[field.name].append(float(value))
+    return DecodedCapture(timestamps, valid, channels)
+
+
+if __name__ == '__main__':
+    # python capture.py <capture file> <DSG|DRRG> [word order], prints the decoded responses as CSV,
+    # those of the legacy request then those of every read planned from the `<registers>` of config.xml
+    from registers import load_register_map, plan_reads
+
+    source = DataSource(sys.argv[2])
+    with open(sys.argv[1], 'rb') as f:
+        data = f.read()
+    channels = [channel for channel in load_register_map('config.xml') if channel.source == source]
+    for layout in [RESPONSE_LAYOUTS[source]] + [plan.layout() for plan in plan_reads(channels)]:
+        decoded = decode_capture(data, source, *sys.argv[3:4], layout=layout)
+        print('# request %s' % layout.request.hex())
+        print(','.join(['timestamp', 'valid'] + list(decoded.channels)))
+        for row in zip(decoded.timestamps, decoded.valid, *decoded.channels.values()):
+            print(','.join(str(value) for value in row))
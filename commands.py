@@ -1,14 +1,20 @@
 """
 Lora Specific Command Stuff
 """
-from typing import final, Union, Optional
+import re
+import threading
+from typing import final, Union, Optional, Callable
 
 import serial
-from enum import Enum
+from enum import Enum, auto
+from collections import deque
+from concurrent.futures import Future
 from dataclasses import dataclass, field
 from datetime import datetime
 from abc import ABC, abstractmethod
+from time import monotonic, sleep
 
+from airtime import AirtimeBudget, Priority, RadioSettings, uplink_airtime
 from logs import EventType
 
 
@@ -34,6 +40,8 @@ class ReplyFormat:
 
 CMSG_AWK_REPLY_OK = ReplyFormat('ACK Received', 'Done', EventType.CMSG_OK)
 
+DOWNLINK_PATTERN = re.compile(r'PORT:\s*(\d+);\s*RX:\s*"((?:[0-9A-Fa-f]{2})*)"')
+
 
 def get_command(cmd):
     """
@@ -43,6 +51,28 @@ def get_command(cmd):
     return cmd.value
 
 
+def get_reply_name(cmd) -> str:
+    """ Name the modem uses to prefix the replies of a command, e.g. `AT+CMSG` replies with `+CMSG: ...`
+
+    :param cmd: `AT`
+    :return: `str`
+    """
+    return get_command(cmd).split('+')[-1]
+
+
+def split_reply(line: str) -> tuple[Optional[str], str]:
+    """ Splits a modem reply into its command name and body.
+
+    :param line: `str` e.g. '+CMSG: ACK Received'
+    :return: `tuple` of the name ('CMSG') and the body ('ACK Received'), the name is `None`
+        when the line has no '+NAME:' prefix
+    """
+    if line.startswith('+') and ':' in line:
+        name, _, body = line[1:].partition(':')
+        return name.strip(), body.strip()
+    return None, line.strip()
+
+
 def write_to_serial(port, command, arg=None):
     """ Writes the command to the serial port
 
@@ -104,29 +134,360 @@ class CMessageOkHandler(MessageHandler):
         print("\n\n")
 
 
+def parse_downlink_line(line: str) -> Optional[tuple[int, bytes]]:
+    """ Finds the downlink in a CMSG reply line, e.g. 'PORT: 10; RX: "0105"'
+
+    :param line: `str`
+    :return: `tuple` of the FPort and the payload, `None` if the line carries no downlink
+    """
+    match = DOWNLINK_PATTERN.search(line)
+    if match is None:
+        return None
+    return int(match.group(1)), bytes.fromhex(match.group(2))
+
+
+class CMessageDownlinkHandler(CMessageOkHandler):
+    """Passes the downlink carried in an acknowledged CMSG reply frame to `on_downlink`"""
+
+    def __init__(self, on_downlink: Callable[[int, bytes], None]):
+        super().__init__()
+        self.on_downlink = on_downlink
+
+    def process(self, msg: SerialMessage):
+        super().process(msg)
+        for line in msg.lines:
+            downlink = parse_downlink_line(line)
+            if downlink is not None:
+                self.on_downlink(*downlink)
+
+
 class SerialDispatcher:
-    def __init__(self, port: serial.Serial, handlers=Optional[list[MessageHandler]]):
+    def __init__(self, port: serial.Serial, handlers: Optional[list[MessageHandler]] = None):
         self.port = port
         self.handlers = handlers or []
         self.buffer = []
         self.active_handler: Union[MessageHandler, None] = None
 
+    def dispatch(self, line: str):
+        """Routes a single line to the matching or active handler"""
+        if self.active_handler is None:
+            # look for a handler that matches this line
+            for handler in self.handlers:
+                if handler.can_handle(line):
+                    self.active_handler = handler
+                    self.buffer = [line]
+                    break
+        else:
+            # continue collecting for the active handler
+            done, msg = self.active_handler.feed(line, self.buffer)
+            if done:
+                handler, self.active_handler = self.active_handler, None  # reset even if `process` raises
+                handler.process(msg)
+
     def run(self):
         while True:  # this uses the `command` oop principle
             if self.port.in_waiting:
                 line = self.port.readline().decode().strip()  # decode and strip might be unnecessary
                 print(line)  # TODO: Remove later, this is just for testing.
+                self.dispatch(line)
+
+
+################
+# LoRa Command Pipeline
+################
+
+
+class CommandStatus(Enum):
+    ACK = auto()      # the modem (and for confirmed commands, the network) accepted the command
+    NACK = auto()     # the modem finished the command but it failed or was never acknowledged
+    TIMEOUT = auto()  # no final reply before the command's deadline
+    BUSY = auto()     # the modem refused the command because it is still busy
+    DROPPED = auto()  # a routine uplink held back by the budget and replaced by a newer one, never sent
+
+
+@dataclass
+class CommandResult:
+    command: AT
+    status: CommandStatus
+    lines: list[str]
+    attempts: int
+
+
+@dataclass(frozen=True)
+class ReplyMarkers:
+    """Substrings of the reply bodies that decide how a command ends.
+
+    `ack` and `nack` are only remembered until the `done` line arrives, `final_ack` and `error` end the
+    command right away. When `confirmed` is False, reaching `done` is an acknowledgement by itself.
+    """
+    ack: tuple[str, ...] = ()
+    final_ack: tuple[str, ...] = ()
+    nack: tuple[str, ...] = ('failed',)
+    error: tuple[str, ...] = ('ERROR', 'Please join network first')
+    busy: tuple[str, ...] = ('busy',)
+    done: Optional[str] = 'Done'
+    confirmed: bool = True
+
+
+REPLY_MARKERS = {
+    AT.AT: ReplyMarkers(final_ack=('OK',), done=None),
+    AT.OK: ReplyMarkers(final_ack=('OK',), done=None),
+    AT.MSG: ReplyMarkers(confirmed=False),
+    AT.JOIN: ReplyMarkers(ack=('Network joined',), final_ack=('Joined already',)),
+    AT.CMSG: ReplyMarkers(ack=('ACK Received',)),
+}
+
+# Seconds to wait for the final reply of each command type, confirmed commands wait on the network.
+COMMAND_DEADLINES = {
+    AT.AT: 1.0,
+    AT.OK: 1.0,
+    AT.MSG: 10.0,
+    AT.JOIN: 20.0,
+    AT.CMSG: 30.0,
+}
+
+RETRY_ON = (CommandStatus.TIMEOUT, CommandStatus.BUSY)
+
+UPLINK_COMMANDS = (AT.MSG, AT.CMSG)  # commands that put a frame on air
+
+
+@dataclass
+class _PendingCommand:
+    command: AT
+    arg: Optional[str]
+    future: Future
+    priority: Priority = Priority.ROUTINE
+    deferred: bool = False  # held back by the airtime budget at least once
+    attempts: int = 0
+    deadline: float = 0.0
+    not_before: float = 0.0  # backoff, the command is not (re)sent before this time
+    sent: bool = False
+    ack_seen: bool = False
+    nack_seen: bool = False
+    lines: list[str] = field(default_factory=list)
+
+
+class CommandPipeline:
+    """Sends AT commands one at a time and resolves each with a `Future[CommandResult]`.
+
+    Only one command is outstanding on the modem at a time, the rest wait in a FIFO queue that `ALERT`
+    commands may jump. A command that times out or finds the modem busy is re-sent after an exponential
+    backoff until `max_attempts` is reached. With a `budget`, every uplink attempt first takes its time on
+    air from the `AirtimeBudget` and waits in the queue while the budget is short, a newer routine
+    uplink replaces one that is still waiting so the backlog cannot grow. Every line read from the
+    modem is also handed (without its '+NAME:' prefix) to the optional `SerialDispatcher` so the
+    existing `MessageHandler`s keep working.
+
+    `poll()` does a single non-blocking step, `start()` runs it on a background thread.
+    """
+
+    def __init__(self, port: serial.Serial, dispatcher: Optional[SerialDispatcher] = None,
+                 deadlines: Optional[dict] = None, max_attempts: int = 3,
+                 backoff_base: float = 2.0, backoff_max: float = 60.0,
+                 budget: Optional[AirtimeBudget] = None, radio: RadioSettings = RadioSettings(),
+                 clock: Callable[[], float] = monotonic):
+        self.port = port
+        self.dispatcher = dispatcher
+        self.deadlines = {**COMMAND_DEADLINES, **(deadlines or {})}
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.radio = radio
+        self.clock = clock
+
+        self._queue: deque[_PendingCommand] = deque()
+        self._current: Optional[_PendingCommand] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, command: AT, arg: Optional[str] = None, priority: Priority = Priority.ROUTINE) -> Future:
+        """ Queues a command, it is written to the modem once every earlier command is resolved.
+
+        :param command: `AT`
+        :param arg: `string`
+        :param priority: `Priority` an `ALERT` is sent before queued routine commands
+        :return: `Future` that resolves to a `CommandResult`
+        """
+        pending = _PendingCommand(command=command, arg=arg, future=Future(), priority=priority)
+        pending.future.set_running_or_notify_cancel()
+        with self._lock:
+            dropped = self._coalesce(pending)
+            self._queue.append(pending)
+        for old in dropped:
+            old.future.set_result(CommandResult(old.command, CommandStatus.DROPPED, old.lines, old.attempts))
+        return pending.future
+
+    @property
+    def pending(self) -> int:
+        """Number of commands that are queued or outstanding"""
+        with self._lock:
+            return len(self._queue) + (self._current is not None)
+
+    def poll(self):
+        """Reads every waiting line, expires deadlines and sends the next command.
+
+        The lock is only held to update the queue and the current command, the port is read and written
+        and the handlers run without it, so `submit()` never waits on the modem.
+        """
+        finished = []
+        try:
+            lines = []
+            while self.port.in_waiting:
+                line = self.port.readline().decode(errors='replace').strip()
+                if line:
+                    lines.append(line)
+            with self._lock:
+                for line in lines:
+                    self._handle_line(line, finished)
+                self._check_deadline(finished)
+                pending = self._send_next()
+            for line in lines:
+                self._dispatch(line)
+            if pending is not None:
+                self._write(pending, finished)
+        finally:
+            for pending, status in finished:  # resolve outside the lock, callbacks may submit again
+                pending.future.set_result(CommandResult(pending.command, status, pending.lines, pending.attempts))
+
+    def start(self, interval: float = 0.05):
+        """Runs `poll()` on a daemon thread every `interval` seconds"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, interval: float):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:  # the thread is the only one writing to the modem, it must survive
+                print('LoRa Pipeline: %s: %s' % (type(e).__name__, e))
+            sleep(interval)
+
+    def _dispatch(self, line: str):
+        if self.dispatcher is None:
+            return
+        _, body = split_reply(line)
+        try:
+            self.dispatcher.dispatch(body)
+        except Exception as e:  # a failing handler must not hold up the command it replies to
+            print('LoRa Pipeline: handler failed on %r: %s: %s' % (body, type(e).__name__, e))
+
+    def _handle_line(self, line: str, finished: list):
+        name, body = split_reply(line)
+        current = self._current
+        if current is None or not current.sent or name != get_reply_name(current.command):
+            return
+        current.lines.append(line)
+        status = self._classify(current, body)
+        if status is not None:
+            self._finish(status, finished)
+
+    @staticmethod
+    def _classify(pending: _PendingCommand, body: str) -> Optional[CommandStatus]:
+        markers = REPLY_MARKERS.get(pending.command, ReplyMarkers())
+        lowered = body.lower()
+        if any(marker.lower() in lowered for marker in markers.busy):
+            return CommandStatus.BUSY
+        if any(body.startswith(marker) for marker in markers.error):
+            return CommandStatus.NACK
+        if any(marker in body for marker in markers.final_ack):
+            return CommandStatus.ACK
+        if any(marker in body for marker in markers.nack):
+            pending.nack_seen = True
+        if any(marker in body for marker in markers.ack):
+            pending.ack_seen = True
+        if markers.done is not None and body.startswith(markers.done):
+            if pending.nack_seen:
+                return CommandStatus.NACK
+            if pending.ack_seen or not markers.confirmed:
+                return CommandStatus.ACK
+            return CommandStatus.NACK
+        return None
+
+    def _check_deadline(self, finished: list):
+        current = self._current
+        if current is not None and current.sent and self.clock() >= current.deadline:
+            self._finish(CommandStatus.TIMEOUT, finished)
+
+    def _finish(self, status: CommandStatus, finished: list):
+        current = self._current
+        if status in RETRY_ON and current.attempts < self.max_attempts:
+            backoff = min(self.backoff_base * 2 ** (current.attempts - 1), self.backoff_max)
+            print('LoRa Pipeline: %s %s, retrying in %.1fs' % (current.command.name, status.name, backoff))
+            current.sent = False
+            current.ack_seen = current.nack_seen = False
+            current.not_before = self.clock() + backoff
+            return
+        self._current = None
+        finished.append((current, status))
+
+    def _send_next(self) -> Optional[_PendingCommand]:
+        """Marks the next command as sent and returns it, the caller writes it once the lock is released"""
+        if self._current is None:
+            self._current = self._pop_next()
+            if self._current is None:
+                return None
+        current = self._current
+        if current.sent:
+            return None
+        if self.clock() < current.not_before or not self._admit(current):
+            # nothing is outstanding on the modem, so a waiting command must not hold up a queued alert
+            self._queue.appendleft(current)
+            self._current = None
+            return None
+        current.attempts += 1
+        current.sent = True
+        current.deadline = self.clock() + self.deadlines.get(current.command, COMMAND_DEADLINES[AT.CMSG])
+        return current
+
+    def _write(self, pending: _PendingCommand, finished: list):
+        try:
+            write_to_serial(self.port, pending.command, pending.arg)
+        except Exception as e:
+            print('LoRa Pipeline: %s not sent: %s: %s' % (pending.command.name, type(e).__name__, e))
+            with self._lock:
+                if self._current is pending:
+                    self._finish(CommandStatus.NACK, finished)
+
+    def _pop_next(self) -> Optional[_PendingCommand]:
+        if not self._queue:
+            return None
+        pending = next((p for p in self._queue if p.priority == Priority.ALERT), self._queue[0])
+        self._queue.remove(pending)
+        return pending
+
+    def _coalesce(self, pending: _PendingCommand) -> list[_PendingCommand]:
+        """Removes the routine uplinks of the same command still held back by the budget, a newer one replaces them"""
+        if self.budget is None or pending.command not in UPLINK_COMMANDS or pending.priority != Priority.ROUTINE:
+            return []
+        dropped = [p for p in self._queue if p.command == pending.command and p.priority == Priority.ROUTINE
+                   and p.deferred and p.attempts == 0]
+        for old in dropped:
+            self._queue.remove(old)
+            self.budget.drop()
+            print('LoRa Pipeline: %s %s dropped, replaced by a newer uplink' % (old.command.name, old.arg))
+        return dropped
 
-                if self.active_handler is None:
-                    # look for a handler that matches this line
-                    for handler in self.handlers:
-                        if handler.can_handle(line):
-                            self.active_handler = handler
-                            self.buffer = [line]
-                            break
-                else:
-                    # continue collecting for the active handler
-                    done, msg = self.active_handler.feed(line, self.buffer)
-                    if done:
-                        self.active_handler.process(msg)
-                        self.active_handler = None
+    def _admit(self, pending: _PendingCommand) -> bool:
+        """Takes an uplink's time on air from the budget, or defers it until the budget has refilled"""
+        if self.budget is None or pending.command not in UPLINK_COMMANDS:
+            return True
+        airtime = uplink_airtime(pending.arg or '', self.radio)
+        if self.budget.try_consume(airtime, pending.priority):
+            return True
+        if not pending.deferred:
+            pending.deferred = True
+            self.budget.defer()
+        pending.not_before = self.clock() + self.budget.time_until(airtime, pending.priority)
+        return False
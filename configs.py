@@ -53,6 +53,35 @@ def _read_config(file_path):
     return config
 
 
+def parse_section_config(file_path: str, subfield: str) -> dict:
+    """ Parse XML config where the subfield holds string values.
+
+    Args:
+        file_path:`str` The filepath of the xml file.
+        subfield:`str` The subfield that contains the config.
+
+    Returns:
+        `dict` of the values as `str`, empty if the subfield is missing.
+    """
+    return _read_config(file_path).get(subfield, {})
+
+
+def parse_list_config(file_path: str, subfield: str) -> list[dict]:
+    """ Parse XML config where the subfield holds a list of elements with string values.
+
+    Args:
+        file_path:`str` The filepath of the xml file.
+        subfield:`str` The subfield that contains the elements.
+
+    Returns:
+        `list` of one `dict` per element, empty if the subfield is missing.
+    """
+    section = ElementTree.parse(file_path).getroot().find(subfield)
+    if section is None:
+        return []
+    return [{item.tag: item.text for item in element} for element in section]
+
+
 def parse_serial_config(file_path, subfield) -> dict:  # `subfield` needs to be renamed
     tree = ElementTree.parse(file_path)
     section = tree.find(subfield)
@@ -84,3 +113,25 @@ def parse_string_config(file_path: str, subfield: str) -> str:
         if section.tag == subfield:
             return section.text
     return ''
+
+
+def parse_numeric_config(file_path: str, subfield: str) -> dict:
+    """ Parse XML config where every value of the subfield is a number.
+
+    Args:
+        file_path:`str` The filepath of the xml file.
+        subfield:`str` The subfield that contains the numeric config.
+
+    Returns:
+        `dict` of the values as `int` or `float`, empty if the subfield is missing.
+    """
+    tree = ElementTree.parse(file_path)
+    section = tree.find(subfield)
+    if section is None:
+        return {}
+
+    config = {}
+    for item in section:
+        text = item.text.strip()
+        config[item.tag] = int(text) if text.lstrip('-').isdigit() else float(text)
+    return config
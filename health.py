@@ -0,0 +1,81 @@
+"""
+Per Device Health Tracking and Circuit Breaker
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum, auto
+from time import monotonic
+from typing import Callable, Optional
+
+from data import DataSource
+
+
+class BreakerState(Enum):
+    CLOSED = auto()     # device is healthy, polled every tick
+    OPEN = auto()       # device is down, not polled until the next probe
+    HALF_OPEN = auto()  # probing, a single success closes the breaker again
+
+
+@dataclass
+class HealthEvent:
+    source: DataSource
+    previous: BreakerState
+    state: BreakerState
+    failures: int
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+class DeviceHealth:
+    """Circuit breaker for a single sensor.
+
+    After `failure_threshold` consecutive failures the breaker opens and the device is left alone until
+    its probe time, which doubles after every failed probe (`backoff_base` up to `backoff_max` seconds).
+    Every state change is passed to the `listeners` as a `HealthEvent`.
+    """
+
+    def __init__(self, source: DataSource, failure_threshold: int = 3, backoff_base: float = 60.0,
+                 backoff_max: float = 3600.0, listeners: Optional[list[Callable[[HealthEvent], None]]] = None,
+                 clock: Callable[[], float] = monotonic):
+        self.source = source
+        self.failure_threshold = failure_threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.listeners = listeners or []
+        self.clock = clock
+
+        self.state = BreakerState.CLOSED
+        self.failures = 0     # consecutive failed reads
+        self.open_count = 0   # consecutive times the breaker opened, drives the probe backoff
+        self.probe_at = 0.0
+
+    def allow_request(self) -> bool:
+        """Whether the device should be polled this tick, moves an expired open breaker to half-open"""
+        if self.state == BreakerState.OPEN:
+            if self.clock() < self.probe_at:
+                return False
+            self._transition(BreakerState.HALF_OPEN)
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.open_count = 0
+        if self.state != BreakerState.CLOSED:
+            self._transition(BreakerState.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                self._open()
+
+    def _open(self):
+        backoff = min(self.backoff_base * 2 ** self.open_count, self.backoff_max)
+        self.open_count += 1
+        self.probe_at = self.clock() + backoff
+        self._transition(BreakerState.OPEN)
+
+    def _transition(self, state: BreakerState):
+        event = HealthEvent(self.source, self.state, state, self.failures)
+        self.state = state
+        for listener in self.listeners:
+            listener(event)
@@ -0,0 +1,131 @@
+"""
+LoRa Network Join State Machine
+"""
+import random
+import threading
+from collections import deque
+from enum import Enum, auto
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+from commands import AT, CommandPipeline, CommandResult, CommandStatus, split_reply
+
+
+class JoinState(Enum):
+    IDLE = auto()     # never joined
+    JOINING = auto()  # an `AT+JOIN` is in the pipeline
+    JOINED = auto()
+    FAILED = auto()   # the last join failed, another is scheduled after a backoff
+
+
+class JoinManager:
+    """Joins the LoRa network through the `CommandPipeline` and decides when a re-join is needed.
+
+    The join result is read from the modem's replies (`+JOIN: Network joined` / `+JOIN: Join failed`),
+    so a join takes exactly as long as the modem needs. Failed joins are retried with an exponential
+    backoff plus jitter so a fleet of stations does not retry in lockstep. Once joined, the session is
+    only considered lost when the recent uplink failure rate reaches `rejoin_ratio`.
+    """
+
+    def __init__(self, pipeline: CommandPipeline, backoff_base: float = 10.0, backoff_max: float = 900.0,
+                 jitter: float = 0.5, window: int = 10, min_samples: int = 5, rejoin_ratio: float = 0.8,
+                 clock: Callable[[], float] = monotonic, rand: Callable[[], float] = random.random):
+        self.pipeline = pipeline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.min_samples = min_samples
+        self.rejoin_ratio = rejoin_ratio
+        self.clock = clock
+        self.rand = rand
+
+        self.state = JoinState.IDLE
+        self.failures = 0  # consecutive failed joins
+        self.retry_at = 0.0
+        self.net_id: Optional[str] = None
+        self.dev_addr: Optional[str] = None
+        self.uplinks: deque[bool] = deque(maxlen=window)  # True for every acknowledged uplink
+        self._lock = threading.Lock()
+
+    def join(self, max_attempts: int = 3, wait: Callable[[float], None] = sleep) -> bool:
+        """ Blocks until the node joins or `max_attempts` joins failed.
+
+        Args:
+            max_attempts: `int` number of `AT+JOIN` to try before giving up, `maintain()` keeps retrying.
+            wait: `Callable` used to wait out the backoff between attempts.
+        Returns:
+            `bool` whether the node joined the network.
+        """
+        for attempt in range(max_attempts):
+            self._on_result(self._start().result())
+            if self.state == JoinState.JOINED:
+                return True
+            if attempt + 1 < max_attempts:
+                wait(max(0.0, self.retry_at - self.clock()))
+        return False
+
+    def maintain(self) -> Optional[object]:
+        """ Non-blocking check done once per loop, starts a join when one is due.
+
+        Returns:
+            the `Future` of the join that was started, otherwise `None`.
+        """
+        with self._lock:
+            due = ((self.state == JoinState.FAILED and self.clock() >= self.retry_at)
+                   or (self.state == JoinState.JOINED and self._session_lost()))
+        if not due:
+            return None
+        future = self._start()
+        future.add_done_callback(lambda f: self._on_result(f.result()))
+        return future
+
+    def record_uplink(self, status: CommandStatus):
+        """Tracks the outcome of a confirmed uplink, a `BUSY` modem or a `DROPPED` frame says nothing of the session"""
+        if status in (CommandStatus.BUSY, CommandStatus.DROPPED):
+            return
+        with self._lock:
+            self.uplinks.append(status == CommandStatus.ACK)
+
+    @property
+    def failure_rate(self) -> float:
+        with self._lock:
+            if not self.uplinks:
+                return 0.0
+            return self.uplinks.count(False) / len(self.uplinks)
+
+    def _session_lost(self) -> bool:
+        if len(self.uplinks) < self.min_samples:
+            return False
+        return self.uplinks.count(False) / len(self.uplinks) >= self.rejoin_ratio
+
+    def _start(self):
+        with self._lock:
+            self.state = JoinState.JOINING
+        return self.pipeline.submit(AT.JOIN)
+
+    def _on_result(self, result: CommandResult):
+        with self._lock:
+            self._parse_progress(result.lines)
+            if result.status == CommandStatus.ACK:
+                print('LoRa Join: joined, NetID %s DevAddr %s' % (self.net_id, self.dev_addr))
+                self.state = JoinState.JOINED
+                self.failures = 0
+                self.uplinks.clear()
+                return
+            self.failures += 1
+            self.state = JoinState.FAILED
+            self.retry_at = self.clock() + self._backoff()
+            print('LoRa Join: %s (%d in a row), retrying in %.0fs'
+                  % (result.status.name, self.failures, self.retry_at - self.clock()))
+
+    def _backoff(self) -> float:
+        backoff = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+        return backoff * (1 - self.jitter) + backoff * self.jitter * self.rand()
+
+    def _parse_progress(self, lines: list[str]):
+        for line in lines:
+            _, body = split_reply(line)
+            if body.startswith('NetID'):  # e.g. 'NetID 000024 DevAddr 48:00:00:01'
+                parts = body.split()
+                self.net_id = parts[1] if len(parts) > 1 else None
+                self.dev_addr = parts[3] if len(parts) > 3 else None
@@ -17,7 +17,25 @@ class EventType(Enum):  # TODO: This enum might be pointless
     CMSG_NOK = auto()
 
 
-def rename_log_file(now: datetime) -> None:
+def get_rotated_path(path: str, now: datetime) -> str:
+    """Path a log file is renamed to at rotation, e.g. 'data_log.csv' -> 'data_log_01-15-24.csv'"""
     previous_day: str = (now - timedelta(days=1)).strftime("%m-%d-%y")  # format should be 'mm-dd'
-    os.rename(DATA_LOG_PATH, DATA_LOG_PATH[:-4] + '_' + previous_day + DATA_LOG_PATH[-4:])
-    os.rename(EVENT_LOG_PATH, EVENT_LOG_PATH[:-4] + '_' + previous_day + EVENT_LOG_PATH[-4:])
+    return path[:-4] + '_' + previous_day + path[-4:]
+
+
+def rotate_file(path: str, now: datetime) -> None:
+    """Renames a log file after the day that ended, skipped when there is no file, e.g. no events were
+    logged that day or a rotation interrupted by a restart already renamed it"""
+    try:
+        os.rename(path, get_rotated_path(path, now))
+    except FileNotFoundError:
+        print('Nothing to rotate at %s' % path)
+
+
+def rename_log_file(now: datetime) -> None:
+    rotate_file(DATA_LOG_PATH, now)
+    rename_event_log_file(now)
+
+
+def rename_event_log_file(now: datetime) -> None:
+    rotate_file(EVENT_LOG_PATH, now)
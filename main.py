@@ -1,16 +1,70 @@
+import sys
+
 import serial
 import serial.rs485
 
 from crccheck.crc import Crc16Modbus
 from datetime import datetime, timedelta
+from functools import partial
+from multiprocessing import Event, Process
 from struct import unpack
 from time import sleep
-
-from commands import write_to_serial, AT, SerialDispatcher, CMessageOkHandler
-from configs import parse_serial_config, DRRG_COMM_0, DSG_COMM_0
+from typing import Optional
+
+from airtime import AirtimeBudget, Priority, RadioSettings
+from api import ReadingCache, ReadingServer
+from archive import get_decimals
+from burst import BurstSettings, BurstStats, read_burst
+from capture import FrameCapture, CapturingPort
+from commands import AT, SerialDispatcher, CMessageDownlinkHandler, CommandPipeline
+from configs import parse_serial_config, parse_string_config, parse_numeric_config, parse_section_config, \
+    DRRG_COMM_0, DSG_COMM_0
 from data import SensorData, DataSource, RawData, RAIN_DATA_FORMAT, RAIN_ACCU_FORMAT, FLOOD_FORMAT, CompiledSensorData
 from generics import write_to_csv
-from logs import rename_log_file, DATA_LOG_PATH
+from health import DeviceHealth, HealthEvent
+from join import JoinManager
+from logs import EVENT_LOG_PATH
+from profiling import Profiler
+from registers import ReadPlan, load_register_map, group_by_source, plan_reads
+from ring import ReadingRing, RingReader, Reading, FLAG_UPLINK, FLAG_ALERT
+from state import StateFile, RuntimeState, STATE_PATH
+from storage import open_storage
+from tuning import TuningStore, RuntimeConfig, UplinkFilter, TUNING_PATH
+
+
+# sensors described by the `<registers>` of config.xml, the others are read with their legacy reader
+REGISTER_MAP = group_by_source(load_register_map('config.xml'))
+SENSOR_PLANS = {source: plan_reads(channels) for source, channels in REGISTER_MAP.items()}
+
+# unit and data formats of every sensor, used to report a sensor as null
+SENSOR_LAYOUT = {
+    DataSource.DIGITAL_STAFF_GAUGE: ('cm', [FLOOD_FORMAT]),
+    DataSource.DIGITAL_RAIN_GAUGE: ('mm', [RAIN_DATA_FORMAT, RAIN_ACCU_FORMAT]),
+}
+SENSOR_LAYOUT.update({source: (channels[0].unit, [channel.format for channel in channels])
+                      for source, channels in REGISTER_MAP.items()})
+
+CHANNEL_NAMES = {
+    DataSource.DIGITAL_STAFF_GAUGE: ['water_level'],
+    DataSource.DIGITAL_RAIN_GAUGE: ['rain', 'rain_accu'],
+}
+CHANNEL_NAMES.update({source: [channel.name for channel in channels] for source, channels in REGISTER_MAP.items()})
+
+# ring, API and archive columns, in layout order, e.g. 'dsg_water_level'
+CHANNELS = [source.value.lower() + '_' + name for source in SENSOR_LAYOUT for name in CHANNEL_NAMES[source]]
+
+# name and decimals of every column in the binary daily archive
+ARCHIVE_CHANNELS = [(name, get_decimals(data_format)) for name, data_format in
+                    zip(CHANNELS, [data_format for _, formats in SENSOR_LAYOUT.values() for data_format in formats])]
+
+# (source, channel) of every column, how the SQLite storage maps its rows back to CSV columns
+STORAGE_COLUMNS = [(source.value, channel) for source, (_, formats) in SENSOR_LAYOUT.items()
+                   for channel in range(len(formats))]
+
+BURST = BurstSettings.from_config(parse_numeric_config('config.xml', 'burst'))
+BURST_LOG_PATH = parse_string_config('config.xml', 'burstlogpath')
+
+ALERT_LEVEL = float(parse_string_config('config.xml', 'alertlevel') or 'inf')  # water level (cm) sent as alert
 
 
 def get_data_from_port(port, comm, line_mode) -> bytes:
@@ -27,20 +81,58 @@ def do_crc_check(data) -> int:
     return crc.final()
 
 
-def setup(port):
-    """Lora Node Join Network"""
+def setup(port, join_manager: JoinManager):
+    """Lora Node Join Network, returns as soon as the modem reports the join result"""
     if not port.is_open:
         raise Exception("Lora Node is not open")  # Logging
 
-    write_to_serial(port, AT.JOIN)
-    sleep(5)  # 10 seconds to be safe
+    if join_manager.join():
+        print('LoRa Node: Network joined')
+    else:
+        print('LoRa Node: Join failed, retrying in the background')
+
 
-    if port.in_waiting:
-        while port.in_waiting:
-            reply = port.readline()
-            print('LoRa Node:', reply)
+def get_null_data(source: DataSource, initial_time) -> SensorData:
+    """Sensor data where every datum is null, reported as `NULL_FORMAT` in the payload"""
+    unit, formats = SENSOR_LAYOUT[source]
+    return SensorData(
+        source=source,
+        unit=unit,
+        date=initial_time,
+        data=[RawData(format=data_format, datum=None) for data_format in formats]
+    )
+
+
+def read_device(health: DeviceHealth, reader, initial_time, port, enabled: bool = True) -> SensorData:
+    """ Reads a sensor through its circuit breaker
+    Args:
+        health:
+            `DeviceHealth` of the sensor
+        reader:
+            `get_dsg_data` or `get_drrg_data`
+        initial_time:
+            time when the data was retrieved
+        port:
+            `serial.Serial` port of the sensor
+        enabled:
+            whether the sensor is enabled in the `RuntimeConfig`
+    Returns:
+        `SensorData` of the sensor, null without touching the bus while disabled or the breaker is open
+    """
+    if not enabled or not health.allow_request():
+        return get_null_data(health.source, initial_time)
+    data, has_error = reader(initial_time, port)
+    if has_error:
+        health.record_failure()
     else:
-        print('No Reply from LoRa Node')
+        health.record_success()
+    return data
+
+
+def log_health_event(event: HealthEvent):
+    print('%s is now %s after %d failure(s)' % (event.source.value, event.state.name, event.failures))
+    write_to_csv(EVENT_LOG_PATH, [event.timestamp, event.source.value, event.previous.name, event.state.name,
+                                  event.failures])
 
 
 # TODO: Determine if nomadic error handling should be done
@@ -70,9 +162,7 @@ def get_drrg_data(initial_time, port) -> tuple[SensorData, bool]:
         error_msg = "CRC Check Failed! DRRG"
     if error_msg:
         print(error_msg)
-        data.append_data(RawData(format=RAIN_DATA_FORMAT, datum=None))
-        data.append_data(RawData(format=RAIN_ACCU_FORMAT, datum=None))
-        return data, True
+        return get_null_data(DataSource.DIGITAL_RAIN_GAUGE, initial_time), True
 
     rain_data, accu_data = bytearray(0), bytearray(0)
     rain_temp, accu_temp = bytearray(4), bytearray(4)
@@ -126,8 +216,7 @@ def get_dsg_data(initial_time, port) -> tuple[SensorData, bool]:
         error_msg = "CRC Check Failed! DSG"
     if error_msg:
         print(error_msg)
-        data.data = [RawData(format=FLOOD_FORMAT, datum=None)]
-        return data, True
+        return get_null_data(DataSource.DIGITAL_STAFF_GAUGE, initial_time), True
 
     water_level = float(int.from_bytes(raw_data[4:5], "big"))
     print("Water level: %s cm" % water_level)
@@ -136,6 +225,56 @@ def get_dsg_data(initial_time, port) -> tuple[SensorData, bool]:
     return data, False
 
 
+def get_register_data(plans: list[ReadPlan], source: DataSource, initial_time, port) -> tuple[SensorData, bool]:
+    """ Reads a sensor described by the register map
+    Args:
+        plans:
+            `ReadPlan`s of the sensor, see `registers.plan_reads`
+        source:
+            `DataSource` of the sensor
+        initial_time:
+            time when the data was retrieved
+        port:
+            `serial.Serial` port where data will be retrieved
+    Returns:
+        `tuple` of len 2 where the first element is the sensor data and
+        the second element is whether a read failed
+    """
+    values = {}
+    for plan in plans:
+        port.write(plan.request)
+        raw_data = port.read(plan.response_length)  # the length is known, no need to wait for a line
+        error_msg = None
+        if len(raw_data) != plan.response_length:
+            error_msg = "ERROR: No communication with %s!" % source.value
+        elif do_crc_check(raw_data) != 0:
+            error_msg = "CRC Check Failed! %s" % source.value
+        if error_msg:
+            print(error_msg)
+            return get_null_data(source, initial_time), True
+        values.update(plan.decode(raw_data))
+
+    unit, formats = SENSOR_LAYOUT[source]
+    data = SensorData(source=source, unit=unit, date=initial_time, data=[])
+    for name, data_format in zip(CHANNEL_NAMES[source], formats):
+        print("%s %s: %s %s" % (source.value, name, values[name], unit))
+        data.append_data(RawData(format=data_format, datum=values[name]))
+    return data, False
+
+
+def get_sensor_reader(source: DataSource):
+    """Reader of a sensor for `read_device`, generated from the register map when it describes the sensor"""
+    if source in SENSOR_PLANS:
+        return partial(get_register_data, SENSOR_PLANS[source], source)
+    return {DataSource.DIGITAL_STAFF_GAUGE: get_dsg_data, DataSource.DIGITAL_RAIN_GAUGE: get_drrg_data}[source]
+
+
+def print_command_result(future):
+    """Prints the `CommandResult` of a resolved pipeline future"""
+    result = future.result()
+    print('LoRa %s: %s after %d attempt(s)' % (result.command.name, result.status.name, result.attempts))
+
+
 def get_next_midnight(now: datetime) -> datetime:
     """get next midnight
     Args:
@@ -147,16 +286,52 @@ def get_next_midnight(now: datetime) -> datetime:
     return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
 
 
-def main():
-    import RPi.GPIO as GPIO
-    # GPIO Variables\Methods
-    GPIO.setwarnings(False)
-    GPIO.setmode(GPIO.BOARD)
-
-    # Initialize Variables
+def schedule_tick(state: RuntimeState, now: datetime, config: RuntimeConfig) -> tuple[Optional[datetime], bool]:
+    """ Advances the scheduler state by one loop
+    Args:
+        state:
+            `RuntimeState` that is checkpointed every tick
+        now:
+            datetime of the loop
+        config:
+            `RuntimeConfig` of this loop
+    Returns:
+        `tuple` of the midnight the logs have to be rotated at (`None` when no rotation is due) and
+        whether this loop's reading is sent over LoRa
+    """
+    rotate_at = None
+    if now > state.next_midnight:
+        rotate_at = state.next_midnight
+        state.next_midnight = get_next_midnight(now)
+    state.loops_since_cmsg += 1
+    uplink = state.loops_since_cmsg >= config.uplink_interval
+    if uplink:
+        state.loops_since_cmsg = 0
+        state.uplink_count += 1
+    return rotate_at, uplink
+
+
+def rotate_storage(storage, rotate_at: datetime):
+    """Rotates the logs, a failure is only printed since the next midnight is already checkpointed"""
+    try:
+        storage.rotate(rotate_at)  # names the files after the day that ended
+    except OSError as e:
+        print('Log Rotation Failed: %s' % e)
+
+
+def load_state(now: datetime) -> tuple[StateFile, RuntimeState]:
+    """Resumes the uplink cadence and the pending rotation from before a restart or power loss"""
+    state_file = StateFile(STATE_PATH)
+    state = state_file.load() or RuntimeState()
+    if state.next_midnight is None:
+        state.next_midnight = get_next_midnight(now)
+    print('Resuming from', state)
+    return state_file, state
+
+
+def open_sensor_ports() -> tuple[serial.Serial, serial.Serial]:
     DSG_PORT = serial.Serial(**parse_serial_config('config.xml', 'dsg'))
     DRRG_PORT = serial.Serial(**parse_serial_config('config.xml', 'drrg'))
-    LORA_PORT = serial.Serial(**parse_serial_config('config.xml', 'lora'))
 
     DSG_PORT.rs485_mode = serial.rs485.RS485Settings(
         rts_level_for_tx=False,
@@ -171,54 +346,347 @@ def main():
         delay_before_tx=0.0,
         delay_before_rx=0.0
     )
-    setup(LORA_PORT)
+    return DSG_PORT, DRRG_PORT
+
+
+def open_capture(DSG_PORT, DRRG_PORT) -> tuple[Optional[FrameCapture], tuple]:
+    """Wraps the sensor ports to record every Modbus frame when `config.xml` has a `<capturepath>`"""
+    capture_path = parse_string_config('config.xml', 'capturepath')
+    if not capture_path:
+        return None, (DSG_PORT, DRRG_PORT)
+    capture = FrameCapture(capture_path)
+    return capture, (CapturingPort(DSG_PORT, capture, DataSource.DIGITAL_STAFF_GAUGE),
+                     CapturingPort(DRRG_PORT, capture, DataSource.DIGITAL_RAIN_GAUGE))
+
+
+def open_lora(tuning: TuningStore) -> tuple[serial.Serial, CommandPipeline, JoinManager]:
+    """Opens the LoRa node, starts its command pipeline and joins the network"""
+    LORA_PORT = serial.Serial(**parse_serial_config('config.xml', 'lora'))
+    radio_config = parse_numeric_config('config.xml', 'radio')
+    lora = CommandPipeline(
+        LORA_PORT,
+        dispatcher=SerialDispatcher(LORA_PORT, handlers=[CMessageDownlinkHandler(tuning.apply)]),
+        budget=AirtimeBudget.from_config(radio_config),
+        radio=RadioSettings.from_config(radio_config),
+    )
+    lora.start()
+    join_manager = JoinManager(lora)
+
+    setup(LORA_PORT, join_manager)
+    return LORA_PORT, lora, join_manager
+
+
+def get_priority(payload: CompiledSensorData) -> Priority:
+    """Readings with a water level at or above `ALERT_LEVEL` may use the airtime kept for alerts"""
+    for sensor_data in payload.data:
+        if sensor_data.source != DataSource.DIGITAL_STAFF_GAUGE:
+            continue
+        if any(datum is not None and datum >= ALERT_LEVEL for datum in sensor_data.get_datum()):
+            return Priority.ALERT
+    return Priority.ROUTINE
+
+
+def send_uplink(lora: CommandPipeline, join_manager: JoinManager, payload: str,
+                priority: Priority = Priority.ROUTINE, confirmation: str = ''):
+    # LoRa replies are handled by the pipeline thread, the result arrives on the future
+    uplink = lora.submit(AT.CMSG, payload + confirmation, priority=priority)
+    uplink.add_done_callback(print_command_result)
+    uplink.add_done_callback(lambda f: join_manager.record_uplink(f.result().status))
+    if lora.budget is not None:
+        print('Airtime Budget:', lora.budget.metrics())
+
+
+def compile_reading(reading: Reading) -> tuple[datetime, CompiledSensorData]:
+    """Rebuilds the `CompiledSensorData` of a ring record, channels follow `SENSOR_LAYOUT`"""
+    now = datetime.fromtimestamp(reading.timestamp)
+    values = iter(reading.values)
+    data = []
+    for source, (unit, formats) in SENSOR_LAYOUT.items():
+        sensor_data = SensorData(source=source, unit=unit, date=now, data=[])
+        for data_format in formats:
+            sensor_data.append_data(RawData(format=data_format, datum=next(values)))
+        data.append(sensor_data)
+    return now, CompiledSensorData(data=data)
+
+
+def run_logger(ring: ReadingRing, stop: Event, interval: float = 0.5):
+    """Ring consumer that stores every reading and rotates the logs when told to"""
+    Profiler.ignore_signal()
+    # the ring is new, so every record from the first is stored, even those published while the storage opens
+    reader = RingReader(ring, from_start=True)
+    storage = open_storage(parse_section_config('config.xml', 'storage'), STORAGE_COLUMNS, ARCHIVE_CHANNELS)
+    while not stop.is_set():
+        for reading in reader.read():
+            if reading.midnight:
+                rotate_storage(storage, datetime.fromtimestamp(reading.midnight))
+            now, payload = compile_reading(reading)
+            storage.write(now, payload)
+        sleep(interval)
+    storage.close()
+
+
+def start_api() -> Optional[ReadingServer]:
+    """Starts the local read API when `config.xml` has an `<api>` section"""
+    api_config = parse_numeric_config('config.xml', 'api')
+    if 'port' not in api_config:
+        return None
+    server = ReadingServer(ReadingCache(api_config.get('size', 1440), CHANNELS), api_config['port'])
+    server.start()
+    return server
+
+
+def run_api(ring: ReadingRing, stop: Event, interval: float = 0.5):
+    """Ring consumer that keeps the API cache filled"""
+    Profiler.ignore_signal()
+    server = start_api()
+    if server is None:
+        return
+    reader = RingReader(ring, from_start=True)
+    while not stop.is_set():
+        for reading in reader.read():
+            server.cache.append(reading.timestamp, list(reading.values))
+        sleep(interval)
+    server.stop()
+
+
+def run_uplink(ring: ReadingRing, stop: Event, interval: float = 0.5):
+    """Ring consumer that owns the LoRa node and sends the readings flagged for uplink"""
+    Profiler.ignore_signal()
+    # from the first record, joining can take minutes and the readings flagged meanwhile are still sent
+    reader = RingReader(ring, from_start=True)
+    tuning = TuningStore(TUNING_PATH)  # downlinks are applied here and picked up by the acquisition loop
+    LORA_PORT, lora, join_manager = open_lora(tuning)
+    while not stop.is_set():
+        join_manager.maintain()
+        for reading in reader.read():
+            if reading.flags & FLAG_UPLINK:
+                now, payload = compile_reading(reading)
+                priority = Priority.ALERT if reading.flags & FLAG_ALERT else Priority.ROUTINE
+                send_uplink(lora, join_manager, payload.get_full_payload(now), priority, tuning.confirmation())
+        sleep(interval)
+    lora.stop()
+    LORA_PORT.close()
+
+
+def open_profiler() -> Profiler:
+    """Profiler of the acquisition loop, `SIGUSR1` starts a session"""
+    profiler = Profiler.from_config(parse_numeric_config('config.xml', 'profiling'))
+    profiler.install_signal()
+    return profiler
+
+
+def log_burst_stats(now: datetime, stats: BurstStats):
+    print('%s burst: %d of %d reads accepted, spread %s' % (stats.source.value, stats.accepted, stats.attempts,
+                                                            stats.spread))
+    if BURST_LOG_PATH:
+        write_to_csv(BURST_LOG_PATH, [now, stats.source.value, stats.attempts, stats.accepted] + stats.spread)
+
+
+def acquire_burst(now: datetime, config: RuntimeConfig, sensors: list[tuple], burst: BurstSettings) -> list[SensorData]:
+    """ Reads every sensor `burst.samples` times and keeps the median of the samples that are not outliers
+    Args:
+        now:
+            datetime of the loop
+        config:
+            `RuntimeConfig` that enables or disables the sensors
+        sensors:
+            `list` of `tuple`s of a sensor's `DeviceHealth` and port
+        burst:
+            `BurstSettings` of the burst
+    Returns:
+        `list` of `SensorData` in `sensors` order, a whole burst counts as one success or failure
+    """
+    reads = {health.source: partial(get_sensor_reader(health.source), now, port) for health, port in sensors
+             if config.is_enabled(health.source) and health.allow_request()}
+    accumulators = read_burst(reads, burst)
+
+    data = []
+    for health, _ in sensors:
+        result = accumulators[health.source].result(burst.threshold) if health.source in accumulators else None
+        if result is None:
+            if health.source in accumulators:
+                health.record_failure()  # every read of the burst failed
+            data.append(get_null_data(health.source, now))
+            continue
+        health.record_success()
+        sensor_data, stats = result
+        log_burst_stats(now, stats)
+        data.append(sensor_data)
+    return data
+
+
+def acquire(now: datetime, config: RuntimeConfig, dsg, drrg,
+            burst: BurstSettings = BurstSettings()) -> CompiledSensorData:
+    """ Reads every sensor once, or in a burst
+    Args:
+        now:
+            datetime of the loop
+        config:
+            `RuntimeConfig` that enables or disables the sensors
+        dsg, drrg:
+            `tuple` of the sensor's `DeviceHealth` and port
+        burst:
+            `BurstSettings`, a single read per sensor unless `burst.samples` is above 1
+    Returns:
+        `CompiledSensorData` in `SENSOR_LAYOUT` order
+    """
+    if burst.samples > 1:
+        return CompiledSensorData(data=acquire_burst(now, config, [dsg, drrg], burst))
+    dsg_health, dsg_port = dsg
+    drrg_health, drrg_port = drrg
+    dsg_data = read_device(dsg_health, get_sensor_reader(dsg_health.source), now, dsg_port,
+                           config.is_enabled(dsg_health.source))
+    drrg_data = read_device(drrg_health, get_sensor_reader(drrg_health.source), now, drrg_port,
+                            config.is_enabled(drrg_health.source))
+    return CompiledSensorData(data=[dsg_data, drrg_data])
+
+
+def run_serial(DSG_PORT, DRRG_PORT):
+    """Acquisition, logging and uplink one after the other in a single loop"""
+    tuning = TuningStore(TUNING_PATH)
+    LORA_PORT, lora, join_manager = open_lora(tuning)
     print('Setup Finished')
 
+    dsg_health = DeviceHealth(DataSource.DIGITAL_STAFF_GAUGE, listeners=[log_health_event])
+    drrg_health = DeviceHealth(DataSource.DIGITAL_RAIN_GAUGE, listeners=[log_health_event])
+
     now = datetime.now()  # this should fix race condition
-    loops_since_cmsg = 0
+    state_file, state = load_state(now)
 
-    # TODO: Fix condition where power out occurs before next midnight is checked.
-    next_midnight = get_next_midnight(now)
-    while DSG_PORT.is_open and DRRG_PORT.is_open:
-        if now > next_midnight:
-            write_to_serial(LORA_PORT, AT.JOIN)
-            rename_log_file(now)
-            next_midnight = get_next_midnight(now)
+    uplink_filter = UplinkFilter()
+    api = start_api()
+    storage = open_storage(parse_section_config('config.xml', 'storage'), STORAGE_COLUMNS, ARCHIVE_CHANNELS)
+    profiler = open_profiler()
 
+    while DSG_PORT.is_open and DRRG_PORT.is_open:
+        profiler.begin_cycle()
+        config = tuning.config  # downlinks swap the whole config, it is read once per loop
+        join_manager.maintain()  # re-joins only when uplinks show the session is lost
+        rotate_at, uplink = schedule_tick(state, now, config)
+        if rotate_at is not None:
+            state_file.save(state)  # before rotating, so a rotation that fails is not replayed on every restart
+            rotate_storage(storage, rotate_at)
 
         ### <-- This block is responsible for retrieving, logging, and transmitting data.
-        dsg_data, has_error_1 = get_dsg_data(now, DSG_PORT)
-        drrg_data, has_error_2 = get_drrg_data(now, DRRG_PORT)
-        payload = CompiledSensorData(data=[dsg_data, drrg_data])
-        write_to_csv(DATA_LOG_PATH, payload.get_csv_format(now))
-        loops_since_cmsg += 1
-        if loops_since_cmsg >= 2:
-            write_to_serial(LORA_PORT, AT.CMSG, payload.get_full_payload(now))
-            loops_since_cmsg = 0
+        payload = acquire(now, config, (dsg_health, DSG_PORT), (drrg_health, DRRG_PORT), BURST)
+        csv_row = payload.get_csv_format(now)
+        if api is not None:
+            api.cache.append(now.timestamp(), csv_row[1:])
+        storage.write(now, payload)
+        if uplink and uplink_filter.allow(csv_row[1:], config.deadband):
+            send_uplink(lora, join_manager, payload.get_full_payload(now), get_priority(payload),
+                        tuning.confirmation())
         ### <--
 
-        # TODO: Next Block Should be Responsible for Reading the Buffer for any CMSG ACK or ERRORs
-
-        ### <-- This block is responsible for handling LoRa response.
-        sleep(0.5)
-        # if LORA_PORT.in_waiting:
-        #     while LORA_PORT.in_waiting:
-        #         reply = LORA_PORT.readline()
-        #         print('Device Reply: ', reply)
-        # else:
-        #     print('Receive Buffer is Empty.')
-        # SerialDispatcher(LORA_PORT, handlers=[CMessageOkHandler()]).run()
-        ### <--
+        state.last_tick = now
+        state_file.save(state)
+        profiler.end_cycle()
+
+        print('\n')
+
+        sleep(config.sample_interval)
+        now = datetime.now()
+
+    if api is not None:
+        api.stop()
+    storage.close()
+    lora.stop()
+    state_file.close()
+    LORA_PORT.close()
+
+
+def get_stopped_consumers(consumers: list[Process]) -> list[str]:
+    """Names of the ring consumers that are no longer running"""
+    return [consumer.name for consumer in consumers if not consumer.is_alive()]
+
+
+def run_ring(DSG_PORT, DRRG_PORT, capacity: int = 1440) -> bool:
+    """ Acquisition publishes to a shared memory ring, logging and uplink run in their own processes
+    Returns:
+        `bool` False when a consumer stopped, the service then exits so that systemd restarts all of them
+    """
+    ring = ReadingRing.create(capacity, len(CHANNELS))
+    stop = Event()
+    Profiler.ignore_signal()  # inherited by the consumers until they ignore it themselves
+    consumers = [Process(target=run_logger, args=(ring, stop), name='logger', daemon=True),
+                 Process(target=run_uplink, args=(ring, stop), name='uplink', daemon=True)]
+    if 'port' in parse_numeric_config('config.xml', 'api'):
+        consumers.append(Process(target=run_api, args=(ring, stop), name='api', daemon=True))
+    for consumer in consumers:
+        consumer.start()
+    print('Setup Finished')
+
+    dsg_health = DeviceHealth(DataSource.DIGITAL_STAFF_GAUGE, listeners=[log_health_event])
+    drrg_health = DeviceHealth(DataSource.DIGITAL_RAIN_GAUGE, listeners=[log_health_event])
+
+    now = datetime.now()
+    state_file, state = load_state(now)
+    tuning = TuningStore(TUNING_PATH)
+    uplink_filter = UplinkFilter()
+    profiler = open_profiler()  # after the consumers started, they keep ignoring the signal
+
+    running = True
+    while DSG_PORT.is_open and DRRG_PORT.is_open:
+        stopped = get_stopped_consumers(consumers)
+        if stopped:  # readings would be published to nobody
+            print('Ring Consumer Stopped: %s' % ', '.join(stopped))
+            running = False
+            break
+        profiler.begin_cycle()
+        tuning.refresh()  # downlinks are applied by the uplink process
+        config = tuning.config
+        rotate_at, uplink = schedule_tick(state, now, config)
+        if rotate_at is not None:
+            state_file.save(state)  # before the logger rotates, so a rotation that fails is not replayed
+
+        payload = acquire(now, config, (dsg_health, DSG_PORT), (drrg_health, DRRG_PORT), BURST)
+        values = payload.get_csv_format(now)[1:]
+        flags = FLAG_UPLINK if uplink and uplink_filter.allow(values, config.deadband) else 0
+        if get_priority(payload) == Priority.ALERT:
+            flags |= FLAG_ALERT
+        ring.publish(now.timestamp(), values, flags=flags,
+                     midnight=rotate_at.timestamp() if rotate_at is not None else 0.0)
+
+        state.last_tick = now
+        state_file.save(state)
+        profiler.end_cycle()
 
         print('\n')
 
-        sleep(60)
+        sleep(config.sample_interval)
         now = datetime.now()
 
+    stop.set()
+    for consumer in consumers:
+        consumer.join()
+    state_file.close()
+    ring.close()
+    return running
+
+
+def main():
+    import RPi.GPIO as GPIO
+    # GPIO Variables\Methods
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BOARD)
+
+    # Initialize Variables
+    DSG_PORT, DRRG_PORT = open_sensor_ports()
+    capture, sensor_ports = open_capture(DSG_PORT, DRRG_PORT)
+
+    running = True
+    if parse_string_config('config.xml', 'architecture') == 'ring':
+        running = run_ring(*sensor_ports)
+    else:
+        run_serial(*sensor_ports)
+
+    if capture is not None:
+        capture.close()
     DSG_PORT.close()
     DRRG_PORT.close()
-    LORA_PORT.close()
     print('Ports Closed.')
+    if not running:
+        sys.exit(1)  # a non-zero status, so that systemd restarts the service
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+"""
+Profiling Mode: cProfile, tracemalloc and RSS Tracking
+"""
+import cProfile
+import os
+import pstats
+import resource
+import signal
+import tracemalloc
+from datetime import datetime
+from typing import Optional
+
+from generics import write_to_csv
+from logs import EVENT_LOG_PATH
+
+
+PROFILE_DIRECTORY = os.path.dirname(EVENT_LOG_PATH or '')  # next to the data and event logs
+
+# allocations made by the profiler itself are not what we are looking for
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+]
+
+
+def get_rss() -> tuple[int, Optional[int]]:
+    """Peak and current resident set size in KiB, the current size is `None` without `/proc`"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        current = None
+    return peak, current
+
+
+class Profiler:
+    """Profiles the acquisition loop on demand and tracks its memory over months.
+
+    A session starts at the next cycle once requested, through `<profiling><enabled>` or `SIGUSR1`, and
+    lasts `cycles` cycles. Meanwhile cProfile only runs between `begin_cycle()` and `end_cycle()`, so
+    the sleep between readings is left out, and a tracemalloc snapshot is compared to the previous one
+    every `snapshot_interval` cycles. At the end the stats are written to `profile_<start>.prof` (for
+    `pstats`/snakeviz) and `profile_<start>.txt`, the allocation growth to `tracemalloc_<start>.txt`.
+
+    Every `rss_interval` cycles, in a session or not, the peak and current RSS are appended to
+    `rss_log.csv`. Outside a session a cycle costs two attribute checks and a counter. A report that
+    cannot be written is logged and skipped, the acquisition loop never sees the error.
+    """
+
+    def __init__(self, directory: str, cycles: int = 60, snapshot_interval: int = 10, top: int = 15,
+                 rss_interval: int = 60):
+        self.directory = directory
+        self.cycles = cycles
+        self.snapshot_interval = snapshot_interval
+        self.top = top
+        self.rss_interval = rss_interval  # 0 disables the RSS log
+
+        self.cycle = 0
+        self.requested = False
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._session_cycle = 0
+        self._started = ''
+        self._owns_tracemalloc = False
+
+    @classmethod
+    def from_config(cls, config: dict, directory: str = PROFILE_DIRECTORY) -> 'Profiler':
+        """ Builds the profiler of the `<profiling>` section.
+
+        Raises:
+            `ValueError` if `cycles`, `snapshotinterval` or `top` is below 1, or `rssinterval` below 0.
+        """
+        for key, minimum in (('cycles', 1), ('snapshotinterval', 1), ('top', 1), ('rssinterval', 0)):
+            if key in config and config[key] < minimum:
+                raise ValueError('<profiling><%s> must be at least %d, got %s' % (key, minimum, config[key]))
+        profiler = cls(
+            directory,
+            cycles=config.get('cycles', 60),
+            snapshot_interval=config.get('snapshotinterval', 10),
+            top=config.get('top', 15),
+            rss_interval=config.get('rssinterval', 60),
+        )
+        profiler.requested = bool(config.get('enabled', 0))
+        return profiler
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def request(self, signum=None, frame=None):
+        """Starts a session at the next cycle, only sets a flag so it is safe as a signal handler"""
+        self.requested = True
+
+    def install_signal(self, signum: int = signal.SIGUSR1):
+        signal.signal(signum, self.request)
+
+    @staticmethod
+    def ignore_signal(signum: int = signal.SIGUSR1):
+        """For the processes without a profiler, the signal is sent to the whole service and would kill them"""
+        signal.signal(signum, signal.SIG_IGN)
+
+    def begin_cycle(self):
+        if self.requested and self._profile is None:
+            self._start()
+        if self._profile is not None:
+            self._profile.enable()
+
+    def end_cycle(self):
+        self.cycle += 1
+        if self._profile is not None:
+            self._profile.disable()
+            self._session_cycle += 1
+            if self._session_cycle % self.snapshot_interval == 0:
+                self._write_snapshot()
+            if self._session_cycle >= self.cycles:
+                self._stop()
+        if self.rss_interval and self.cycle % self.rss_interval == 0:
+            self._write_rss()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _start(self):
+        self.requested = False
+        self._started = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self._session_cycle = 0
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        self._profile = cProfile.Profile()
+        print('Profiling %d cycles from cycle %d' % (self.cycles, self.cycle))
+
+    def _write_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        current, peak = tracemalloc.get_traced_memory()
+        try:
+            with open(self._path('tracemalloc_%s.txt' % self._started), 'a') as f:
+                f.write('cycle %d: traced %d KiB, peak %d KiB, top growth since the last snapshot\n'
+                        % (self.cycle, current // 1024, peak // 1024))
+                for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self.top]:
+                    f.write('    %s\n' % stat)
+        except OSError as e:
+            print('Profiling snapshot not written: %s' % e)
+        self._snapshot = snapshot
+
+    def _stop(self):
+        if self._session_cycle % self.snapshot_interval:
+            self._write_snapshot()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        self._snapshot = None
+
+        profile, self._profile = self._profile, None
+        try:
+            profile.dump_stats(self._path('profile_%s.prof' % self._started))
+            with open(self._path('profile_%s.txt' % self._started), 'w') as f:
+                pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(self.top)
+        except OSError as e:
+            print('Profiling finished, stats not written: %s' % e)
+            return
+        print('Profiling finished, written to %s' % self._path('profile_%s.*' % self._started))
+
+    def _write_rss(self):
+        peak, current = get_rss()
+        try:
+            write_to_csv(self._path('rss_log.csv'), [datetime.now(), self.cycle, peak, current])
+        except OSError as e:
+            print('RSS not logged: %s' % e)
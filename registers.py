@@ -0,0 +1,170 @@
+"""
+Declarative Modbus Register Maps and Read Planning
+"""
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+from crccheck.crc import Crc16Modbus
+
+from capture import MODBUS_HEADER, WORD_ORDERS, RegisterField, ResponseLayout
+from configs import parse_list_config
+from data import DataSource, _DataFormat
+
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+
+# type: (struct format once in big-endian order, registers)
+REGISTER_TYPES = {
+    'uint16': ('>H', 1),
+    'int16': ('>h', 1),
+    'float32': ('>f', 2),
+}
+
+MAX_READ_REGISTERS = 125  # Modbus limit of a single read
+MAX_GAP = 4  # unused registers read in between rather than sending one more request
+
+
+@dataclass(frozen=True)
+class RegisterChannel:
+    """One value of a sensor, a `<channel>` of the `<registers>` section of `config.xml`"""
+    name: str
+    source: DataSource
+    unit: str
+    slave: int
+    address: int
+    format: _DataFormat
+    type: str = 'uint16'
+    word_order: str = 'ABCD'  # of a float32, see `capture.WORD_ORDERS`
+    scale: float = 1.0
+    function: int = READ_HOLDING_REGISTERS
+
+    @property
+    def count(self) -> int:
+        return REGISTER_TYPES[self.type][1]
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'RegisterChannel':
+        """ Builds a channel from the string values of its config element.
+
+        Raises:
+            `ValueError` if a value is missing or invalid.
+        """
+        try:
+            channel = cls(
+                name=config['name'],
+                source=DataSource(config['source']),
+                unit=config.get('unit') or '',
+                slave=int(config.get('slave') or 1),
+                address=int(config['address'], 0),
+                format=_DataFormat(config['format']),
+                type=config.get('type') or 'uint16',
+                word_order=config.get('wordorder') or 'ABCD',
+                scale=float(config.get('scale') or 1),
+                function=int(config.get('function') or READ_HOLDING_REGISTERS),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError('Incomplete register channel %s: %s' % (config, e))
+        if channel.type not in REGISTER_TYPES:
+            raise ValueError('Unknown register type %s' % channel.type)
+        if channel.word_order not in WORD_ORDERS:
+            raise ValueError('Unknown word order %s' % channel.word_order)
+        return channel
+
+
+def load_register_map(file_path: str) -> list[RegisterChannel]:
+    return [RegisterChannel.from_config(config) for config in parse_list_config(file_path, 'registers')]
+
+
+def group_by_source(channels: list[RegisterChannel]) -> dict[DataSource, list[RegisterChannel]]:
+    """Channels of every sensor, in map order"""
+    groups: dict[DataSource, list[RegisterChannel]] = {}
+    for channel in channels:
+        groups.setdefault(channel.source, []).append(channel)
+    return groups
+
+
+def build_read_request(slave: int, function: int, start: int, count: int) -> bytes:
+    """ Modbus RTU read request, CRC included.
+
+    Example:
+        >>> build_read_request(1, READ_HOLDING_REGISTERS, 0, 2).hex()
+        '010300000002c40b'
+    """
+    body = struct.pack('>BBHH', slave, function, start, count)
+    return body + Crc16Modbus.calc(body).to_bytes(2, 'little')
+
+
+@dataclass(frozen=True)
+class ReadPlan:
+    """One Modbus read covering `count` registers from `start`, and the channels decoded from it"""
+    slave: int
+    function: int
+    start: int
+    count: int
+    channels: tuple[RegisterChannel, ...]
+
+    @property
+    def request(self) -> bytes:
+        return build_read_request(self.slave, self.function, self.start, self.count)
+
+    @property
+    def response_length(self) -> int:
+        return MODBUS_HEADER + 2 * self.count + 2  # CRC
+
+    def layout(self) -> ResponseLayout:
+        """Layout of the response for `capture.decode_capture`, scales are not applied"""
+        return ResponseLayout(self.request, self.response_length, tuple(
+            RegisterField(channel.name, channel.address - self.start, channel.type, channel.word_order)
+            for channel in self.channels))
+
+    def decode(self, frame: bytes) -> dict[str, float]:
+        """Scaled value of every channel of a response that passed the length and CRC checks"""
+        values = {}
+        for channel in self.channels:
+            offset = MODBUS_HEADER + 2 * (channel.address - self.start)
+            value_format, count = REGISTER_TYPES[channel.type]
+            raw = frame[offset:offset + 2 * count]
+            if channel.type == 'float32':
+                raw = bytes(raw[position] for position in WORD_ORDERS[channel.word_order])
+            [value] = struct.unpack(value_format, raw)
+            values[channel.name] = value * channel.scale
+        return values
+
+
+def plan_reads(channels: list[RegisterChannel], max_gap: int = MAX_GAP,
+               max_count: int = MAX_READ_REGISTERS) -> list[ReadPlan]:
+    """ Coalesces the channels into the fewest reads with the smallest frames.
+
+    Channels of the same slave and function are sorted by address, a channel joins the previous read
+    when at most `max_gap` unused registers separate them and the read stays within `max_count`.
+
+    Args:
+        channels: `list` of `RegisterChannel`.
+        max_gap: `int` unused registers worth reading to save a request.
+        max_count: `int` registers a single read may cover.
+    Returns:
+        `list` of `ReadPlan` ordered by slave, function and address.
+    Example:
+        >>> [(plan.start, plan.count) for plan in plan_reads([
+        ...     RegisterChannel('rain', DataSource.DIGITAL_RAIN_GAUGE, 'mm', 1, 12, '4.2', 'float32'),
+        ...     RegisterChannel('accu', DataSource.DIGITAL_RAIN_GAUGE, 'mm', 1, 14, '4.17', 'float32')])]
+        [(12, 4)]
+    """
+    plans = []
+    current: Optional[list] = None  # slave, function, start, end, channels of the read being built
+    for channel in sorted(channels, key=lambda c: (c.slave, c.function, c.address)):
+        end = channel.address + channel.count
+        if (current is not None and (channel.slave, channel.function) == (current[0], current[1])
+                and channel.address - current[3] <= max_gap and max(end, current[3]) - current[2] <= max_count):
+            current[3] = max(end, current[3])
+            current[4].append(channel)
+            continue
+        if current is not None:
+            plans.append(current)
+        current = [channel.slave, channel.function, channel.address, end, [channel]]
+    if current is not None:
+        plans.append(current)
+    return [ReadPlan(slave, function, start, end - start, tuple(members))
+            for slave, function, start, end, members in plans]
@@ -0,0 +1,139 @@
+"""
+Shared Memory Ring Buffer of Sensor Readings
+"""
+import math
+import struct
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional
+
+
+RING_MAGIC = b'PNRB'
+
+# magic, capacity, number of channels, head (sequence of the last published record)
+_HEADER_FORMAT = struct.Struct('<4sIIQ')
+_HEAD_OFFSET = 12
+_SEQUENCE_FORMAT = struct.Struct('<Q')
+# sequence, timestamp, midnight to rotate at (0 for none), flags
+_RECORD_PREFIX = struct.Struct('<QddI4x')
+
+FLAG_UPLINK = 0x1  # the record should be sent over LoRa
+FLAG_ALERT = 0x2   # the record is sent with `Priority.ALERT`
+
+
+@dataclass
+class Reading:
+    sequence: int
+    timestamp: float
+    midnight: float
+    flags: int
+    values: tuple[Optional[float], ...]
+
+
+class ReadingRing:
+    """Fixed-size reading records in a `multiprocessing.shared_memory` block.
+
+    A single writer publishes records, any number of `RingReader`s follow it at their own pace. Each
+    slot starts with the sequence number of the record it holds: the writer clears it before writing
+    and sets it afterwards, so a reader that sees the same sequence before and after copying a slot
+    knows the copy is not torn. Sequences start at 1.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        magic, self.capacity, self.channels, _ = _HEADER_FORMAT.unpack_from(shm.buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError('%s is not a reading ring' % shm.name)
+        self._record = struct.Struct(_RECORD_PREFIX.format + 'd' * self.channels)
+
+    @classmethod
+    def create(cls, capacity: int, channels: int, name: Optional[str] = None) -> 'ReadingRing':
+        record_size = struct.calcsize(_RECORD_PREFIX.format + 'd' * channels)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_FORMAT.size + capacity * record_size)
+        shm.buf[:] = bytes(shm.size)
+        _HEADER_FORMAT.pack_into(shm.buf, 0, RING_MAGIC, capacity, channels, 0)
+        return cls(shm, owner=True)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def head(self) -> int:
+        return _SEQUENCE_FORMAT.unpack_from(self.shm.buf, _HEAD_OFFSET)[0]
+
+    def publish(self, timestamp: float, values: list[Optional[float]], flags: int = 0, midnight: float = 0.0) -> int:
+        """ Writes a record, overwriting the oldest one once the ring is full.
+
+        Args:
+            timestamp: `float` POSIX timestamp of the reading.
+            values: `list` of one value per channel, `None` is stored as NaN.
+            flags: `int` e.g. `FLAG_UPLINK`.
+            midnight: `float` timestamp of the midnight the logger rotates at before this record.
+        Returns:
+            `int` sequence number of the record.
+        """
+        sequence = self.head + 1
+        offset = self._offset(sequence)
+        _SEQUENCE_FORMAT.pack_into(self.shm.buf, offset, 0)
+        self._record.pack_into(self.shm.buf, offset, 0, timestamp, midnight, flags,
+                               *[math.nan if value is None else value for value in values])
+        _SEQUENCE_FORMAT.pack_into(self.shm.buf, offset, sequence)
+        _SEQUENCE_FORMAT.pack_into(self.shm.buf, _HEAD_OFFSET, sequence)
+        return sequence
+
+    def read(self, sequence: int) -> Optional[Reading]:
+        """The record with `sequence`, `None` when it was overwritten (or is being overwritten)"""
+        offset = self._offset(sequence)
+        record = self._record.unpack_from(self.shm.buf, offset)
+        if record[0] != sequence or _SEQUENCE_FORMAT.unpack_from(self.shm.buf, offset)[0] != sequence:
+            return None
+        values = tuple(None if math.isnan(value) else value for value in record[4:])
+        return Reading(sequence, record[1], record[2], record[3], values)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _offset(self, sequence: int) -> int:
+        return _HEADER_FORMAT.size + ((sequence - 1) % self.capacity) * self._record.size
+
+
+class RingReader:
+    """Consumer cursor over a `ReadingRing`, counts the records it lost to overruns"""
+
+    def __init__(self, ring: ReadingRing, from_start: bool = False):
+        self.ring = ring
+        head = ring.head
+        self.cursor = max(1, head - ring.capacity + 1) if from_start else head + 1  # next sequence to read
+        self.overruns = 0
+
+    def read(self, max_records: Optional[int] = None) -> list[Reading]:
+        """Every record published since the last call, skipping ahead when the writer lapped the reader"""
+        readings = []
+        head = self.ring.head
+        while self.cursor <= head and (max_records is None or len(readings) < max_records):
+            oldest = head - self.ring.capacity + 1
+            if self.cursor < oldest:
+                self._skip_to(oldest)
+                continue
+            reading = self.ring.read(self.cursor)
+            if reading is None:  # overwritten while reading
+                head = self.ring.head
+                self._skip_to(max(self.cursor + 1, head - self.ring.capacity + 2))
+                continue
+            readings.append(reading)
+            self.cursor += 1
+        return readings
+
+    @property
+    def lag(self) -> int:
+        return self.ring.head - self.cursor + 1
+
+    def _skip_to(self, sequence: int):
+        if sequence > self.cursor:
+            self.overruns += sequence - self.cursor
+            print('Ring Reader: overrun, skipped %d record(s)' % (sequence - self.cursor))
+            self.cursor = sequence
@@ -0,0 +1,102 @@
+"""
+Crash Consistent Runtime State Checkpoint
+"""
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from configs import parse_string_config
+
+
+STATE_PATH = parse_string_config('config.xml', 'statepath')
+
+STATE_MAGIC = b'PNST'
+STATE_VERSION = 1
+
+# magic, version, sequence, loops_since_cmsg, uplink_count, next_midnight, last_tick
+_SLOT_FORMAT = struct.Struct('<4sHQIIdd')
+_CRC_FORMAT = struct.Struct('<I')
+SLOT_SIZE = 64  # fixed slot size, leaves room to append fields without moving the second slot
+N_SLOTS = 2
+
+
+@dataclass
+class RuntimeState:
+    loops_since_cmsg: int = 0
+    uplink_count: int = 0  # number of uplinks submitted since the state file was created
+    next_midnight: Optional[datetime] = None
+    last_tick: Optional[datetime] = None
+
+
+def _to_timestamp(date: Optional[datetime]) -> float:
+    return date.timestamp() if date is not None else 0.0
+
+
+def _from_timestamp(timestamp: float) -> Optional[datetime]:
+    return datetime.fromtimestamp(timestamp) if timestamp > 0 else None
+
+
+class StateFile:
+    """Memory mapped checkpoint of the `RuntimeState` with two slots.
+
+    Every `save()` writes the slot that does not hold the latest state, then the checksum, so a power
+    loss mid-write leaves the other slot intact. `load()` returns the valid slot with the highest
+    sequence number.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        size = SLOT_SIZE * N_SLOTS
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.sequence = 0
+
+    def load(self) -> Optional[RuntimeState]:
+        """ Reads the latest valid state.
+
+        Returns:
+            `RuntimeState` or `None` when neither slot is valid (new or corrupted file).
+        """
+        latest = None
+        for slot in range(N_SLOTS):
+            record = self._read_slot(slot)
+            if record is not None and (latest is None or record[0] > latest[0]):
+                latest = record
+        if latest is None:
+            return None
+        self.sequence, state = latest
+        return state
+
+    def save(self, state: RuntimeState):
+        self.sequence += 1
+        offset = (self.sequence % N_SLOTS) * SLOT_SIZE
+        _SLOT_FORMAT.pack_into(
+            self._map, offset, STATE_MAGIC, STATE_VERSION, self.sequence, state.loops_since_cmsg,
+            state.uplink_count, _to_timestamp(state.next_midnight), _to_timestamp(state.last_tick)
+        )
+        crc = zlib.crc32(self._map[offset:offset + _SLOT_FORMAT.size])
+        _CRC_FORMAT.pack_into(self._map, offset + _SLOT_FORMAT.size, crc)
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+
+    def _read_slot(self, slot: int) -> Optional[tuple[int, RuntimeState]]:
+        offset = slot * SLOT_SIZE
+        body = self._map[offset:offset + _SLOT_FORMAT.size]
+        [crc] = _CRC_FORMAT.unpack_from(self._map, offset + _SLOT_FORMAT.size)
+        if zlib.crc32(body) != crc:
+            return None
+        magic, version, sequence, loops, uplinks, midnight, last_tick = _SLOT_FORMAT.unpack(body)
+        if magic != STATE_MAGIC or version != STATE_VERSION or sequence == 0:
+            return None
+        return sequence, RuntimeState(loops, uplinks, _from_timestamp(midnight), _from_timestamp(last_tick))
@@ -0,0 +1,234 @@
+"""
+Reading Storage Backends: CSV Log Files or SQLite
+"""
+import csv
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime, date, timedelta
+from time import monotonic
+from typing import Optional, Union
+
+from data import CompiledSensorData
+from generics import write_to_csv
+from archive import archive_csv_log
+from logs import get_rotated_path, rename_log_file, rename_event_log_file, DATA_LOG_PATH
+
+
+PARTITION_PREFIX = 'readings_'
+
+
+class CsvStorage:
+    """The original storage: one CSV row per reading, the file is renamed every midnight.
+
+    With `archive_channels` (name and decimals of every column) the renamed day is then converted to a
+    binary archive, see `archive.py`, and the CSV file is removed unless `keep_csv`.
+    """
+
+    def __init__(self, path: str = DATA_LOG_PATH, archive_channels: Optional[list[tuple[str, int]]] = None,
+                 keep_csv: bool = False):
+        self.path = path
+        self.archive_channels = archive_channels
+        self.keep_csv = keep_csv
+
+    def write(self, now: datetime, payload: CompiledSensorData):
+        write_to_csv(self.path, payload.get_csv_format(now))
+
+    def rotate(self, midnight: datetime):
+        rename_log_file(midnight)
+        if self.archive_channels is None:
+            return
+        rotated_path = get_rotated_path(self.path, midnight)
+        if not os.path.exists(rotated_path):  # nothing was logged that day
+            return
+        try:
+            print('Archived', archive_csv_log(rotated_path, self.archive_channels, self.keep_csv))
+        except (OSError, ValueError) as e:  # the CSV file is kept, it can be converted later
+            print('Archiving %s failed: %s' % (rotated_path, e))
+
+    def close(self):
+        pass
+
+
+def get_partition(day: date) -> str:
+    return PARTITION_PREFIX + day.strftime('%Y%m%d')
+
+
+class SqliteStorage:
+    """Readings in an SQLite database in WAL mode, one table per day.
+
+    Rows are `(ts, source, channel, value)`, with `ts` the POSIX timestamp and `channel` the index of the
+    value within its sensor, indexed by `(ts, source)`. `write()` only queues the rows, a background
+    thread inserts them in one transaction per batch (up to `batch_size` readings or `flush_interval`
+    seconds). Daily tables let queries skip every day outside their time range and let retention drop a
+    whole day at once, which replaces renaming the data log at midnight.
+    """
+
+    def __init__(self, path: str, columns: list[tuple[str, int]], retention_days: int = 365,
+                 batch_size: int = 32, flush_interval: float = 5.0):
+        self.path = path
+        self.columns = columns  # (source, channel) of every CSV column, used by `export_csv`
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: queue.Queue = queue.Queue()
+        self._partitions: set[str] = set()
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')  # persistent, readers never block the writer
+            self._partitions.update(self._list_partitions(connection))
+        finally:
+            connection.close()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, now: datetime, payload: CompiledSensorData):
+        rows = []
+        timestamp = now.timestamp()
+        for sensor_data in payload.data:
+            for channel, datum in enumerate(sensor_data.get_datum()):
+                rows.append((timestamp, sensor_data.source.value, channel, datum))
+        self._queue.put(('insert', now.date(), rows))
+
+    def rotate(self, midnight: datetime):
+        """Drops the days older than the retention, the event log is still a CSV file and is renamed"""
+        self._queue.put(('prune', midnight.date() - timedelta(days=self.retention_days), None))
+        try:
+            rename_event_log_file(midnight)
+        except OSError as e:  # retention does not depend on the event log
+            print('Event Log Rotation Failed: %s' % e)
+
+    def flush(self):
+        """Blocks until every queued row is committed"""
+        done = threading.Event()
+        self._queue.put(('flush', None, done))
+        done.wait()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def query(self, start: datetime, end: datetime, source: Optional[str] = None) -> list[tuple]:
+        """ Rows with `start <= ts < end`, only the daily tables in that range are read.
+
+        Args:
+            start: `datetime` inclusive lower bound.
+            end: `datetime` exclusive upper bound.
+            source: `str` e.g. 'DSG', every source when `None`.
+        Returns:
+            `list` of `(ts, source, channel, value)` ordered by time.
+        """
+        day, tables = start.date(), []
+        while day <= end.date():
+            if get_partition(day) in self._partitions:
+                tables.append(get_partition(day))
+            day += timedelta(days=1)
+        if not tables:
+            return []
+
+        where = 'ts >= ? AND ts < ?' + (' AND source = ?' if source is not None else '')
+        params = [start.timestamp(), end.timestamp()] + ([source] if source is not None else [])
+        sql = ' UNION ALL '.join('SELECT ts, source, channel, value FROM %s WHERE %s' % (table, where)
+                                 for table in tables)
+        connection = self._connect()
+        try:
+            return connection.execute(sql + ' ORDER BY ts', params * len(tables)).fetchall()
+        finally:
+            connection.close()
+
+    def export_csv(self, day: date, path: str):
+        """Writes a day in the CSV log format, one row per reading with the columns in `columns` order"""
+        start = datetime(day.year, day.month, day.day)
+        rows: dict[float, list] = {}
+        for timestamp, source, channel, value in self.query(start, start + timedelta(days=1)):
+            row = rows.setdefault(timestamp, [None] * len(self.columns))
+            if (source, channel) in self.columns:
+                row[self.columns.index((source, channel))] = value
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            for timestamp, values in rows.items():
+                writer.writerow([datetime.fromtimestamp(timestamp)] + values)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _list_partitions(connection: sqlite3.Connection) -> list[str]:
+        rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                  (PARTITION_PREFIX + '%',))
+        return [name for (name,) in rows]
+
+    def _run(self):
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA synchronous=NORMAL')  # enough for WAL, a power loss only loses the last batch
+        except sqlite3.Error as e:
+            print('SQLite Storage: %s' % e)
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.flush_interval
+            while batch[-1] is not None and batch[-1][0] == 'insert' and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - monotonic())))
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            self._commit(connection, [item for item in batch if item is not None])
+        connection.close()
+
+    def _commit(self, connection: sqlite3.Connection, batch: list):
+        """Commits a batch, a failed batch is logged and dropped so the writer keeps running"""
+        try:
+            with connection:  # one transaction for the whole batch
+                for operation, day, argument in batch:
+                    if operation == 'insert':
+                        table = self._ensure_partition(connection, day)
+                        connection.executemany('INSERT INTO %s VALUES (?, ?, ?, ?)' % table, argument)
+                    elif operation == 'prune':
+                        for table in sorted(self._partitions):
+                            if table < get_partition(day):
+                                connection.execute('DROP TABLE %s' % table)
+                                self._partitions.discard(table)
+        except (sqlite3.Error, OSError) as e:
+            readings = sum(1 for operation, _, _ in batch if operation == 'insert')
+            print('SQLite Storage: batch of %d readings not stored: %s' % (readings, e))
+            self._reload_partitions(connection)  # the tables created or dropped may have been rolled back
+        finally:
+            for operation, _, argument in batch:
+                if operation == 'flush':
+                    argument.set()
+
+    def _reload_partitions(self, connection: sqlite3.Connection):
+        try:
+            self._partitions = set(self._list_partitions(connection))
+        except sqlite3.Error as e:
+            print('SQLite Storage: cannot list the daily tables: %s' % e)
+
+    def _ensure_partition(self, connection: sqlite3.Connection, day: date) -> str:
+        table = get_partition(day)
+        if table not in self._partitions:
+            connection.execute('CREATE TABLE IF NOT EXISTS %s (ts REAL NOT NULL, source TEXT NOT NULL, '
+                               'channel INTEGER NOT NULL, value REAL)' % table)
+            connection.execute('CREATE INDEX IF NOT EXISTS %s_ts_source ON %s (ts, source)' % (table, table))
+            self._partitions.add(table)
+        return table
+
+
+def open_storage(config: dict, columns: list[tuple[str, int]],
+                 archive_channels: Optional[list[tuple[str, int]]] = None) -> Union[CsvStorage, SqliteStorage]:
+    """ Storage selected by the `<storage>` section of `config.xml`.
+
+    Args:
+        config: `dict` with `backend` ('csv' or 'sqlite'), `sqlitepath`, `retentiondays`, and for the CSV
+            backend `archive` and `keepcsv` ('1' or '0').
+        columns: `list` of the (source, channel) of every CSV column.
+        archive_channels: `list` of the name and decimals of every CSV column, used when `archive` is '1'.
+    """
+    if config.get('backend') == 'sqlite':
+        return SqliteStorage(config['sqlitepath'], columns, retention_days=int(config.get('retentiondays', 365)))
+    if config.get('archive') == '1':
+        return CsvStorage(archive_channels=archive_channels, keep_csv=config.get('keepcsv') == '1')
+    return CsvStorage()
@@ -0,0 +1,53 @@
+import unittest
+
+from airtime import time_on_air, uplink_airtime, RadioSettings, AirtimeBudget, Priority
+from tests.test_commands import FakeClock
+
+
+class TestTimeOnAir(unittest.TestCase):
+
+    def test_known_values(self):
+        self.assertAlmostEqual(0.061696, time_on_air(24, RadioSettings()), places=6)
+        self.assertAlmostEqual(0.616448, time_on_air(51, RadioSettings(spreading_factor=10)), places=6)
+        # SF12 at 125 kHz uses low data rate optimisation
+        self.assertAlmostEqual(1.482752, time_on_air(24, RadioSettings(spreading_factor=12)), places=6)
+
+    def test_uplink_adds_lorawan_overhead(self):
+        radio = RadioSettings()
+        self.assertEqual(time_on_air(13 + 11, radio), uplink_airtime('12345678901', radio))
+
+
+class TestAirtimeBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # 10 seconds of airtime, 2 of them kept for alerts
+        self.budget = AirtimeBudget(duty_cycle=0.01, window=1000.0, alert_reserve=0.2, clock=self.clock)
+
+    def test_routine_stops_at_the_alert_reserve(self):
+        self.assertTrue(self.budget.try_consume(7.5))
+        self.assertFalse(self.budget.try_consume(1.0))
+        self.assertTrue(self.budget.try_consume(1.0, Priority.ALERT))
+        self.assertAlmostEqual(1.5, self.budget.remaining)
+
+    def test_refills_at_the_duty_cycle(self):
+        self.budget.try_consume(8.0)
+        self.assertAlmostEqual(100.0, self.budget.time_until(1.0))  # 1s of airtime every 100s
+        self.clock.now = 100.0
+        self.assertTrue(self.budget.try_consume(1.0))
+        self.clock.now = 1e6
+        self.assertEqual(10.0, self.budget.remaining)  # never above capacity
+
+    def test_metrics(self):
+        self.budget.try_consume(1.0)
+        self.budget.defer()
+        self.budget.drop()
+        metrics = self.budget.metrics()
+        self.assertEqual(1, metrics['sent'])
+        self.assertEqual(1, metrics['deferrals'])
+        self.assertEqual(1, metrics['dropped'])
+        self.assertEqual(9.0, metrics['remaining'])
+
+
+if __name__ == '__main__':
+    unittest.main()
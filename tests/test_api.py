@@ -0,0 +1,67 @@
+import json
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from api import ReadingCache, ReadingServer
+
+
+class TestReadingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ReadingCache(3, ['a', 'b'])
+        for i in range(5):
+            self.cache.append(100.0 + i, [float(i), None])
+
+    def test_keeps_most_recent(self):
+        self.assertEqual([102.0, 103.0, 104.0], [reading[0] for reading in self.cache.snapshot])
+
+    def test_queries(self):
+        self.assertEqual([(104.0, 4.0, None)], self.cache.latest())
+        self.assertEqual([103.0, 104.0], [reading[0] for reading in self.cache.last(2)])
+        self.assertEqual([], self.cache.last(0))
+        self.assertEqual([104.0], [reading[0] for reading in self.cache.since(103.0)])
+        self.assertEqual(3, len(self.cache.since(0)))
+
+    def test_non_finite_values_are_null(self):
+        self.cache.append(200.0, [float('nan'), float('inf')])
+        self.assertEqual([(200.0, None, None)], self.cache.latest())
+
+    def test_snapshot_is_not_mutated(self):
+        snapshot = self.cache.snapshot
+        self.cache.append(200.0, [1.0, 1.0])
+        self.assertEqual(104.0, snapshot[-1][0])
+
+
+class TestReadingServer(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ReadingCache(10, ['water_level'])
+        self.cache.append(100.0, [12.0])
+        self.cache.append(160.0, [None])
+        self.cache.append(220.0, [float('nan')])
+        self.server = ReadingServer(self.cache, port=0)
+        self.server.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get(self, path):
+        with urlopen(self.url + path, timeout=5) as response:
+            return json.loads(response.read())
+
+    def test_endpoints(self):
+        self.assertEqual({'channels': ['water_level'], 'readings': [[220.0, None]]}, self.get('/latest'))
+        self.assertEqual(3, len(self.get('/last?n=5')['readings']))
+        self.assertEqual([[160.0, None], [220.0, None]], self.get('/since?t=100')['readings'])
+
+    def test_bad_requests(self):
+        for path, code in (('/since', 400), ('/last?n=x', 400), ('/missing', 404)):
+            with self.assertRaises(HTTPError) as error:
+                self.get(path)
+            self.assertEqual(code, error.exception.code)
+
+
+if __name__ == '__main__':
+    unittest.main()
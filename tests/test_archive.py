@@ -0,0 +1,133 @@
+import csv
+import math
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import archive
+from archive import Archive, archive_csv_log, get_archive_path, get_decimals, write_archive
+from data import FLOOD_FORMAT, RAIN_DATA_FORMAT, RAIN_ACCU_FORMAT
+from storage import CsvStorage
+
+
+CHANNELS = [('dsg_water_level', 0), ('drrg_rain', 2), ('drrg_rain_accu', 4)]
+START = datetime(2025, 1, 2, 0, 0, 30)
+
+
+def make_rows(n):
+    return [(START + timedelta(minutes=i), [float(100 + i), None if i % 3 else 0.25 * i, 12.3456 + i])
+            for i in range(n)]
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'data_log_01-02-25.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_decimals(self):
+        self.assertEqual([0, 2, 4], [get_decimals(f) for f in (FLOOD_FORMAT, RAIN_DATA_FORMAT, RAIN_ACCU_FORMAT)])
+
+    def test_round_trip_iterator(self):
+        rows = make_rows(5)
+        write_archive(self.path, CHANNELS, rows)
+        with Archive(self.path) as reader:
+            self.assertEqual(['dsg_water_level', 'drrg_rain', 'drrg_rain_accu'], reader.channels)
+            self.assertEqual(5, len(reader))
+            read = list(reader)
+        for (timestamp, values), (expected_time, expected) in zip(read, rows):
+            self.assertEqual(expected_time, timestamp)
+            self.assertEqual(expected[:2], values[:2])
+            self.assertAlmostEqual(expected[2], values[2], places=4)
+
+    def test_record_size(self):
+        write_archive(self.path, CHANNELS, make_rows(1440))
+        header = archive._HEADER.size + len(CHANNELS) * archive._CHANNEL.size
+        self.assertEqual(header + 1440 * 17, os.path.getsize(self.path))  # offset, 3 values and a mask byte
+
+    @unittest.skipIf(archive.np is None, 'numpy is not installed')
+    def test_numpy_views(self):
+        write_archive(self.path, CHANNELS, make_rows(6))
+        reader = Archive(self.path)
+        records = reader.records
+        self.assertFalse(records.flags.writeable)  # a view on the read-only mapping
+        self.assertEqual(30, records['offset'][0])
+        self.assertEqual([0, 3], [i for i in range(6) if not records['mask'][i] & 0b10])
+
+        self.assertEqual(START.timestamp(), reader.timestamps()[0])
+        rain = reader.values('drrg_rain')
+        self.assertEqual([0.0, 0.75], [rain[0], rain[3]])
+        self.assertTrue(math.isnan(rain[1]))
+        del records, rain
+        reader.close()
+
+    def test_out_of_range_value_is_null(self):
+        write_archive(self.path, [('big', 4)], [(START, [1e6])])
+        with Archive(self.path) as reader:
+            self.assertEqual([None], list(reader)[0][1])
+
+    def test_non_finite_values_are_null(self):
+        write_archive(self.path, CHANNELS, [(START, [float('inf'), float('nan'), -float('inf')]),
+                                            (START + timedelta(minutes=1), [100.0, 0.5, 12.0])])
+        with Archive(self.path) as reader:
+            self.assertEqual([[None, None, None], [100.0, 0.5, 12.0]], [values for _, values in reader])
+
+    def test_failed_write_removes_temp_file(self):
+        with self.assertRaises(TypeError):
+            write_archive(self.path, CHANNELS, [(START, [1.0, 2.0, 'x'])])
+        self.assertEqual([], os.listdir(self.directory.name))
+
+    def test_truncated_archive(self):
+        write_archive(self.path, CHANNELS, make_rows(3))
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with Archive(self.path) as reader:
+            self.assertEqual(2, len(list(reader)))
+
+    def test_not_an_archive(self):
+        with open(self.path, 'w') as f:
+            f.write('2025-01-02 00:00:30,100.0,,12.3456\n')
+        with self.assertRaises(ValueError):
+            Archive(self.path)
+
+    def test_archive_csv_log(self):
+        csv_path = os.path.join(self.directory.name, 'data_log_01-02-25.csv')
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            for timestamp, values in make_rows(3):
+                writer.writerow([timestamp] + values)
+
+        self.assertEqual(get_archive_path(csv_path), archive_csv_log(csv_path, CHANNELS))
+        self.assertFalse(os.path.exists(csv_path))
+        with Archive(get_archive_path(csv_path)) as reader:
+            self.assertEqual([101.0, None], list(reader)[1][1][:2])
+
+
+class TestCsvStorageArchive(unittest.TestCase):
+
+    def test_rotate_archives_the_day(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data_log.csv')
+            storage = CsvStorage(path, archive_channels=CHANNELS, keep_csv=True)
+            with open(path, 'w') as f:
+                f.write('2025-01-02 00:00:30,100.0,,12.3456\n')
+            midnight = datetime(2025, 1, 3)
+            with patch('storage.rename_log_file', side_effect=lambda now: os.rename(path, os.path.join(
+                    directory, 'data_log_01-02-25.csv'))):
+                storage.rotate(midnight)
+            self.assertEqual(['data_log_01-02-25.bin', 'data_log_01-02-25.csv'], sorted(os.listdir(directory)))
+
+    @patch('storage.rename_log_file')
+    def test_archive_failure_keeps_running(self, rename_log_file):
+        storage = CsvStorage('/nonexistent/data_log.csv', archive_channels=CHANNELS)
+        storage.rotate(datetime(2025, 1, 3))  # nothing to convert, only printed
+        rename_log_file.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import random
+import statistics
+import threading
+import unittest
+from datetime import datetime
+
+from burst import RunningMedian, BurstAccumulator, BurstSettings, read_burst, get_resolution, MAD_SIGMA
+from data import DataSource, RawData, SensorData, FLOOD_FORMAT, RAIN_DATA_FORMAT, RAIN_ACCU_FORMAT
+from tests.test_commands import FakeClock
+
+NOW = datetime(2025, 1, 2, 10, 0)
+
+
+def dsg(level):
+    return SensorData(DataSource.DIGITAL_STAFF_GAUGE, 'cm', NOW, [RawData(FLOOD_FORMAT, level)])
+
+
+def drrg(rain, accu):
+    return SensorData(DataSource.DIGITAL_RAIN_GAUGE, 'mm', NOW,
+                      [RawData(RAIN_DATA_FORMAT, rain), RawData(RAIN_ACCU_FORMAT, accu)])
+
+
+class TestRunningMedian(unittest.TestCase):
+
+    def test_matches_statistics(self):
+        rng = random.Random(4)
+        for n in range(1, 30):
+            values = [rng.choice([rng.gauss(100, 5), rng.randint(0, 3)]) for _ in range(n)]
+            running = RunningMedian()
+            for value in values:
+                running.add(value)
+            median = statistics.median(values)
+            self.assertEqual(median, running.median())
+            self.assertAlmostEqual(statistics.median(abs(value - median) for value in values), running.mad())
+
+    def test_window(self):
+        running = RunningMedian([5, 1, 3, 9, 7])
+        self.assertEqual([3, 5, 7], running.window(3, 7).values)
+
+
+class TestBurstAccumulator(unittest.TestCase):
+
+    def test_outlier_and_crc_failure_rejected(self):
+        accumulator = BurstAccumulator(DataSource.DIGITAL_STAFF_GAUGE)
+        for level in (101.0, 100.0, 102.0, 180.0, 100.0):  # debris
+            accumulator.add(dsg(level), False)
+        accumulator.add(dsg(None), True)
+
+        data, stats = accumulator.result(threshold=3.0)
+        self.assertEqual([100.5], data.get_datum())  # median of the four kept samples
+        self.assertEqual(FLOOD_FORMAT, data.data[0].format)
+        self.assertEqual((6, 4), (stats.attempts, stats.accepted))
+        self.assertAlmostEqual(4 / 6, stats.quality)
+        self.assertAlmostEqual(MAD_SIGMA * 0.5, stats.spread[0])
+
+    def test_exact_agreement_keeps_one_step(self):
+        accumulator = BurstAccumulator(DataSource.DIGITAL_STAFF_GAUGE)
+        for level in (100.0, 100.0, 100.0, 101.0, 102.0):
+            accumulator.add(dsg(level), False)
+        data, stats = accumulator.result(threshold=3.0)
+        self.assertEqual([100.0], data.get_datum())
+        self.assertEqual(4, stats.accepted)  # 1 cm is the gauge's resolution, 2 cm is an outlier
+        self.assertEqual([0.0], stats.spread)
+
+    def test_get_resolution(self):
+        self.assertEqual(1.0, get_resolution(FLOOD_FORMAT))
+        self.assertAlmostEqual(0.01, get_resolution(RAIN_DATA_FORMAT))
+
+    def test_channels_filtered_separately(self):
+        accumulator = BurstAccumulator(DataSource.DIGITAL_RAIN_GAUGE)
+        for rain, accu in ((0.5, 20.0), (0.5, 20.0), (9.0, None)):
+            accumulator.add(drrg(rain, accu), False)
+        data, stats = accumulator.result(threshold=3.0)
+        self.assertEqual([0.5, 20.0], data.get_datum())
+        self.assertEqual(2, stats.accepted)
+
+    def test_every_read_failed(self):
+        accumulator = BurstAccumulator(DataSource.DIGITAL_STAFF_GAUGE)
+        accumulator.add(dsg(None), True)
+        self.assertIsNone(accumulator.result(threshold=3.0))
+
+
+class TestReadBurst(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.waits = []
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        self.clock.now += seconds
+
+    def test_slots_spread_over_window(self):
+        reads = {DataSource.DIGITAL_STAFF_GAUGE: lambda: (dsg(100.0), False)}
+        accumulators = read_burst(reads, BurstSettings(samples=4, window=2.0), clock=self.clock, wait=self.wait)
+        self.assertEqual([0.5, 0.5, 0.5], self.waits)
+        self.assertEqual(4, accumulators[DataSource.DIGITAL_STAFF_GAUGE].attempts)
+
+    def test_sensors_read_at_the_same_time(self):
+        barrier = threading.Barrier(2, timeout=5)  # broken unless both ports are waiting on a reply together
+
+        def read(data):
+            barrier.wait()
+            return data, False
+
+        reads = {DataSource.DIGITAL_STAFF_GAUGE: lambda: read(dsg(100.0)),
+                 DataSource.DIGITAL_RAIN_GAUGE: lambda: read(drrg(0.0, 1.0))}
+        accumulators = read_burst(reads, BurstSettings(samples=3))
+        self.assertEqual([3, 3], [accumulator.attempts for accumulator in accumulators.values()])
+
+    def test_read_errors_are_raised(self):
+        def read():
+            raise OSError('port closed')
+
+        with self.assertRaises(OSError):
+            read_burst({DataSource.DIGITAL_STAFF_GAUGE: read}, BurstSettings(samples=2))
+
+    def test_slow_reads_shorten_the_burst(self):
+        def slow_read():
+            self.clock.now += 0.8  # timeout of a silent sensor
+            return dsg(None), True
+
+        accumulators = read_burst({DataSource.DIGITAL_STAFF_GAUGE: slow_read}, BurstSettings(samples=5, window=2.0),
+                                  clock=self.clock, wait=self.wait)
+        self.assertEqual(3, accumulators[DataSource.DIGITAL_STAFF_GAUGE].attempts)  # starts at 0, 0.8 and 1.6
+
+    def test_from_config(self):
+        self.assertEqual(BurstSettings(5, 2.0, 2.5), BurstSettings.from_config({'samples': 5, 'window': 2,
+                                                                                'threshold': 2.5}))
+        self.assertEqual(1, BurstSettings.from_config({}).samples)
+
+
+if __name__ == '__main__':
+    unittest.main()
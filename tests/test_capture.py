@@ -0,0 +1,118 @@
+import math
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from crccheck.crc import Crc16Modbus
+
+import capture
+from capture import FrameCapture, CapturingPort, decode_capture, index_capture, REQUEST, RESPONSE
+from configs import DRRG_COMM_0, DSG_COMM_0
+from data import DataSource
+
+
+def with_crc(body: bytes) -> bytes:
+    return body + Crc16Modbus.calc(body).to_bytes(2, 'little')
+
+
+def drrg_response(rain: float, accu: float) -> bytes:
+    registers = bytearray(32)
+    for register, value in ((12, rain), (14, accu)):
+        a, b, c, d = struct.pack('>f', value)
+        registers[2 * register:2 * register + 4] = bytes((c, d, a, b))  # low word first
+    return with_crc(b'\x01\x03\x20' + bytes(registers))
+
+
+def dsg_response(level: int) -> bytes:
+    return with_crc(b'\x01\x03\x04' + level.to_bytes(2, 'big') + b'\x00\x00')
+
+
+class TestFrameCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_capture(self, exchanges):
+        frame_capture = FrameCapture(self.path)
+        for timestamp, source, request, response in exchanges:
+            frame_capture.record(timestamp, source, request, response)
+        frame_capture.close()
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_capturing_port_records_exchanges(self):
+        port = MagicMock()
+        port.readline.return_value = drrg_response(1.5, 20.25)
+        port.is_open = True
+        frame_capture = FrameCapture(self.path)
+        wrapped = CapturingPort(port, frame_capture, DataSource.DIGITAL_RAIN_GAUGE)
+        wrapped.write(DRRG_COMM_0)
+        self.assertEqual(drrg_response(1.5, 20.25), wrapped.readline())
+        self.assertTrue(wrapped.is_open)
+        frame_capture.close()
+
+        with open(self.path, 'rb') as f:
+            index = index_capture(f.read())
+        self.assertEqual([REQUEST, RESPONSE], index.directions)
+        self.assertEqual([len(DRRG_COMM_0), 37], index.lengths)
+        self.assertEqual(DRRG_COMM_0, index.data[index.offsets[0]:index.offsets[0] + index.lengths[0]])
+
+    def test_appends_to_existing_capture(self):
+        self.write_capture([(1.0, DataSource.DIGITAL_STAFF_GAUGE, DSG_COMM_0, dsg_response(1))])
+        data = self.write_capture([(2.0, DataSource.DIGITAL_STAFF_GAUGE, DSG_COMM_0, dsg_response(2))])
+        self.assertEqual([1.0, 1.0, 2.0, 2.0], index_capture(data).timestamps)
+
+    def test_truncated_record_is_dropped(self):
+        data = self.write_capture([(1.0, DataSource.DIGITAL_STAFF_GAUGE, DSG_COMM_0, dsg_response(1))])
+        self.assertEqual(1, len(index_capture(data[:-1]).offsets))
+
+    def test_not_a_capture(self):
+        with self.assertRaises(ValueError):
+            index_capture(b'timestamp,dsg\n')
+
+    def decode_all(self, data, source, word_order=None):
+        decoded = [decode_capture(data, source, word_order)]
+        with patch.object(capture, 'np', None):
+            decoded.append(decode_capture(data, source, word_order))
+        return decoded
+
+    def test_decode_drrg(self):
+        data = self.write_capture([
+            (1.0, DataSource.DIGITAL_RAIN_GAUGE, DRRG_COMM_0, drrg_response(1.5, 20.25)),
+            (2.0, DataSource.DIGITAL_STAFF_GAUGE, DSG_COMM_0, dsg_response(300)),
+            (3.0, DataSource.DIGITAL_RAIN_GAUGE, DRRG_COMM_0, b''),  # no answer
+            (4.0, DataSource.DIGITAL_RAIN_GAUGE, DRRG_COMM_0, drrg_response(0.2, 3.1)[:-1] + b'\x00'),  # bad CRC
+            (5.0, DataSource.DIGITAL_RAIN_GAUGE, DRRG_COMM_0, drrg_response(0.75, 21.0)),
+        ])
+        for decoded in self.decode_all(data, DataSource.DIGITAL_RAIN_GAUGE):
+            self.assertEqual([1.0, 3.0, 4.0, 5.0], list(decoded.timestamps))
+            self.assertEqual([True, False, False, True], list(decoded.valid))
+            rain = list(decoded.channels['rain'])
+            self.assertEqual([1.5, 0.75], [rain[0], rain[3]])
+            self.assertTrue(math.isnan(rain[1]) and math.isnan(rain[2]))
+            self.assertAlmostEqual(21.0, decoded.channels['rain_accu'][3])
+
+    def test_decode_dsg_keeps_the_whole_register(self):
+        data = self.write_capture([(1.0, DataSource.DIGITAL_STAFF_GAUGE, DSG_COMM_0, dsg_response(300))])
+        for decoded in self.decode_all(data, DataSource.DIGITAL_STAFF_GAUGE):
+            self.assertEqual([300.0], list(decoded.channels['water_level']))  # the live decoder keeps 300 % 256
+
+    def test_word_order_override(self):
+        data = self.write_capture([(1.0, DataSource.DIGITAL_RAIN_GAUGE, DRRG_COMM_0, drrg_response(1.5, 20.25))])
+        for decoded in self.decode_all(data, DataSource.DIGITAL_RAIN_GAUGE, 'ABCD'):
+            self.assertNotEqual(1.5, decoded.channels['rain'][0])
+
+    def test_empty_capture(self):
+        data = self.write_capture([])
+        for decoded in self.decode_all(data, DataSource.DIGITAL_RAIN_GAUGE):
+            self.assertEqual(0, len(decoded.timestamps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from airtime import AirtimeBudget, Priority, RadioSettings, uplink_airtime
+from commands import AT, CommandPipeline, CommandStatus, SerialDispatcher, split_reply, get_reply_name, \
+    CMessageDownlinkHandler, parse_downlink_line
+
+
+class FakePort:
+    """Serial port stand-in that records writes and replays queued lines"""
+
+    def __init__(self):
+        self.written = []
+        self.lines = []
+
+    @property
+    def in_waiting(self):
+        return len(self.lines)
+
+    def readline(self):
+        return (self.lines.pop(0) + '\r\n').encode('ascii')
+
+    def write(self, data):
+        self.written.append(data)
+
+    def reply(self, *lines):
+        self.lines.extend(lines)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReplyParsing(unittest.TestCase):
+
+    def test_split_reply(self):
+        self.assertEqual(('CMSG', 'ACK Received'), split_reply('+CMSG: ACK Received'))
+        self.assertEqual((None, 'Done'), split_reply('Done'))
+
+    def test_get_reply_name(self):
+        self.assertEqual('CMSG', get_reply_name(AT.CMSG))
+        self.assertEqual('AT', get_reply_name(AT.AT))
+
+
+class TestDownlinkHandler(unittest.TestCase):
+
+    def test_parse_downlink_line(self):
+        self.assertEqual((10, b'\x01\x00\x3c'), parse_downlink_line('PORT: 10; RX: "01003C"'))
+        self.assertIsNone(parse_downlink_line('RXWIN1, RSSI -106, SNR 4.0'))
+        self.assertIsNone(parse_downlink_line('PORT: 10; RX: "013"'))  # odd number of digits
+
+    def test_downlink_in_reply_frame(self):
+        on_downlink = MagicMock()
+        dispatcher = SerialDispatcher(FakePort(), handlers=[CMessageDownlinkHandler(on_downlink)])
+        for line in ('Start', 'Wait ACK', 'ACK Received', 'PORT: 10; RX: "0205"', 'RXWIN1, RSSI -106, SNR 4.0',
+                     'Done'):
+            dispatcher.dispatch(line)
+        on_downlink.assert_called_once_with(10, b'\x02\x05')
+
+
+class TestCommandPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.port = FakePort()
+        self.clock = FakeClock()
+        self.pipeline = CommandPipeline(self.port, max_attempts=3, backoff_base=1.0, clock=self.clock)
+
+    def test_cmsg_acknowledged(self):
+        future = self.pipeline.submit(AT.CMSG, '1234')
+        self.pipeline.poll()
+        self.assertEqual([b'AT+CMSG="1234"\n'], self.port.written)
+        self.assertFalse(future.done())
+
+        self.port.reply('+CMSG: Start', '+CMSG: Wait ACK', '+CMSG: ACK Received', '+CMSG: Done')
+        self.pipeline.poll()
+        result = future.result(timeout=0)
+        self.assertEqual(CommandStatus.ACK, result.status)
+        self.assertEqual(1, result.attempts)
+        self.assertEqual(4, len(result.lines))
+
+    def test_cmsg_not_acknowledged(self):
+        future = self.pipeline.submit(AT.CMSG, '1234')
+        self.pipeline.poll()
+        self.port.reply('+CMSG: Start', '+CMSG: Wait ACK', '+CMSG: Done')
+        self.pipeline.poll()
+        self.assertEqual(CommandStatus.NACK, future.result(timeout=0).status)
+
+    def test_one_outstanding_command_at_a_time(self):
+        first = self.pipeline.submit(AT.CMSG, '1')
+        second = self.pipeline.submit(AT.CMSG, '2')
+        self.pipeline.poll()
+        self.assertEqual(1, len(self.port.written))
+        self.assertEqual(2, self.pipeline.pending)
+
+        self.port.reply('+CMSG: ACK Received', '+CMSG: Done')
+        self.pipeline.poll()
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        self.assertEqual(b'AT+CMSG="2"\n', self.port.written[-1])
+
+    def test_timeout_retries_with_backoff(self):
+        future = self.pipeline.submit(AT.AT)
+        self.pipeline.poll()
+        self.clock.now = 1.0  # AT deadline
+        self.pipeline.poll()
+        self.assertEqual(1, len(self.port.written))  # waiting out the 1s backoff
+
+        self.clock.now = 2.0
+        self.pipeline.poll()
+        self.assertEqual(2, len(self.port.written))
+
+        self.clock.now = 3.0
+        self.pipeline.poll()
+        self.clock.now = 5.0  # second backoff is 2s
+        self.pipeline.poll()
+        self.assertEqual(3, len(self.port.written))
+
+        self.clock.now = 6.0
+        self.pipeline.poll()
+        result = future.result(timeout=0)
+        self.assertEqual(CommandStatus.TIMEOUT, result.status)
+        self.assertEqual(3, result.attempts)
+
+    def test_busy_is_retried(self):
+        future = self.pipeline.submit(AT.CMSG, '1')
+        self.pipeline.poll()
+        self.port.reply('+CMSG: LoRaWAN modem is busy')
+        self.pipeline.poll()
+        self.assertFalse(future.done())
+
+        self.clock.now = 1.0
+        self.pipeline.poll()
+        self.port.reply('+CMSG: ACK Received', '+CMSG: Done')
+        self.pipeline.poll()
+        result = future.result(timeout=0)
+        self.assertEqual(CommandStatus.ACK, result.status)
+        self.assertEqual(2, result.attempts)
+
+    def test_error_is_not_retried(self):
+        future = self.pipeline.submit(AT.CMSG, '1')
+        self.pipeline.poll()
+        self.port.reply('+CMSG: Please join network first')
+        self.pipeline.poll()
+        self.assertEqual(CommandStatus.NACK, future.result(timeout=0).status)
+        self.assertEqual(1, len(self.port.written))
+
+    def test_lines_forwarded_to_dispatcher(self):
+        dispatcher = SerialDispatcher(self.port)
+        dispatcher.dispatch = MagicMock()
+        pipeline = CommandPipeline(self.port, dispatcher=dispatcher, clock=self.clock)
+        self.port.reply('+CMSG: ACK Received')
+        pipeline.poll()
+        dispatcher.dispatch.assert_called_once_with('ACK Received')
+
+    def test_submit_does_not_wait_on_a_slow_read(self):
+        reading, release = threading.Event(), threading.Event()
+
+        def readline():  # a line still arriving, readline blocks up to the port timeout
+            reading.set()
+            release.wait(5)
+            return b'+CMSG: Done\r\n'
+
+        self.port.reply('')
+        self.port.readline = readline
+        poller = threading.Thread(target=self.pipeline.poll)
+        poller.start()
+        try:
+            self.assertTrue(reading.wait(5))
+            submitted = threading.Thread(target=self.pipeline.submit, args=(AT.CMSG, '1'))
+            submitted.start()
+            submitted.join(1)
+            self.assertFalse(submitted.is_alive())
+        finally:
+            self.port.lines.clear()
+            release.set()
+            poller.join()
+
+    def test_failed_write_resolves_nack(self):
+        self.port.write = MagicMock(side_effect=OSError('device disconnected'))
+        future = self.pipeline.submit(AT.CMSG, '1')
+        self.pipeline.poll()
+        self.assertEqual(CommandStatus.NACK, future.result(timeout=0).status)
+        self.assertEqual(0, self.pipeline.pending)
+
+    def test_failing_handler_does_not_stop_pipeline(self):
+        dispatcher = SerialDispatcher(self.port, handlers=[CMessageDownlinkHandler(MagicMock(side_effect=KeyError))])
+        pipeline = CommandPipeline(self.port, dispatcher=dispatcher, clock=self.clock)
+        first = pipeline.submit(AT.CMSG, '1')
+        second = pipeline.submit(AT.CMSG, '2')
+        pipeline.poll()
+        self.port.reply('+CMSG: ACK Received', '+CMSG: PORT: 10; RX: "0205"', '+CMSG: Done')
+        pipeline.poll()
+        self.assertEqual(CommandStatus.ACK, first.result(timeout=0).status)
+        self.assertIsNone(dispatcher.active_handler)
+        self.assertEqual(b'AT+CMSG="2"\n', self.port.written[-1])
+        self.assertFalse(second.done())
+
+    def test_budget_defers_routine_and_lets_alerts_through(self):
+        airtime = uplink_airtime('1', RadioSettings())
+        # room for two frames, one of them kept for alerts
+        budget = AirtimeBudget(duty_cycle=0.01, window=200 * airtime, alert_reserve=0.5, clock=self.clock)
+        budget.tokens = 1.5 * airtime  # not enough for routine traffic, enough for an alert
+        pipeline = CommandPipeline(self.port, budget=budget, clock=self.clock)
+
+        routine = pipeline.submit(AT.CMSG, '1')
+        pipeline.poll()
+        self.assertEqual([], self.port.written)
+        self.assertEqual(1, budget.deferrals)
+
+        alert = pipeline.submit(AT.CMSG, '2', priority=Priority.ALERT)
+        pipeline.poll()
+        self.assertEqual([b'AT+CMSG="2"\n'], self.port.written)
+        self.port.reply('+CMSG: ACK Received', '+CMSG: Done')
+        pipeline.poll()
+        self.assertEqual(CommandStatus.ACK, alert.result(timeout=0).status)
+        self.assertFalse(routine.done())
+
+        self.clock.now = 1e6  # budget refilled
+        pipeline.poll()
+        self.assertEqual(b'AT+CMSG="1"\n', self.port.written[-1])
+        self.assertEqual(1, budget.deferrals)
+
+    def test_alert_overtakes_routine_waiting_on_budget(self):
+        airtime = uplink_airtime('1', RadioSettings())
+        budget = AirtimeBudget(duty_cycle=0.01, window=200 * airtime, alert_reserve=0.5, clock=self.clock)
+        budget.tokens = 1.5 * airtime
+        pipeline = CommandPipeline(self.port, budget=budget, clock=self.clock)
+
+        routine = pipeline.submit(AT.CMSG, '1')
+        pipeline.poll()
+        for _ in range(3):  # still deferred, polled again while waiting for the budget
+            self.clock.now += 0.05
+            pipeline.poll()
+        self.assertEqual([], self.port.written)
+
+        alert = pipeline.submit(AT.CMSG, '2', priority=Priority.ALERT)
+        pipeline.poll()
+        self.assertEqual([b'AT+CMSG="2"\n'], self.port.written)
+        self.port.reply('+CMSG: ACK Received', '+CMSG: Done')
+        pipeline.poll()
+        self.assertEqual(CommandStatus.ACK, alert.result(timeout=0).status)
+        self.assertFalse(routine.done())
+        self.assertEqual(1, budget.deferrals)
+
+    def test_alert_overtakes_retry_waiting_on_budget(self):
+        airtime = uplink_airtime('1', RadioSettings())
+        budget = AirtimeBudget(duty_cycle=0.01, window=200 * airtime, alert_reserve=0.5, clock=self.clock)
+        budget.tokens = 2.5 * airtime  # one routine frame, then only alerts
+        pipeline = CommandPipeline(self.port, budget=budget, backoff_base=0.0, clock=self.clock)
+
+        routine = pipeline.submit(AT.CMSG, '1')
+        pipeline.poll()
+        self.port.reply('+CMSG: LoRaWAN modem is busy')
+        pipeline.poll()  # the retry is due at once but the budget defers it
+        pipeline.poll()
+        self.assertEqual(1, len(self.port.written))
+
+        alert = pipeline.submit(AT.CMSG, '2', priority=Priority.ALERT)
+        pipeline.poll()
+        self.assertEqual(b'AT+CMSG="2"\n', self.port.written[-1])
+        self.port.reply('+CMSG: ACK Received', '+CMSG: Done')
+        pipeline.poll()
+        self.assertEqual(CommandStatus.ACK, alert.result(timeout=0).status)
+        self.assertFalse(routine.done())
+
+    def test_newer_routine_uplink_replaces_deferred_one(self):
+        airtime = uplink_airtime('1', RadioSettings())
+        budget = AirtimeBudget(duty_cycle=0.01, window=200 * airtime, alert_reserve=0.5, clock=self.clock)
+        budget.tokens = 1.5 * airtime
+        pipeline = CommandPipeline(self.port, budget=budget, clock=self.clock)
+
+        first = pipeline.submit(AT.CMSG, '1')
+        pipeline.poll()
+        second = pipeline.submit(AT.CMSG, '2')
+        self.assertEqual(CommandStatus.DROPPED, first.result(timeout=0).status)
+        third = pipeline.submit(AT.CMSG, '3')  # not deferred yet, nothing to replace
+        self.assertFalse(second.done())
+        self.assertEqual(2, pipeline.pending)
+        self.assertEqual(1, budget.metrics()['dropped'])
+
+        self.clock.now = 1e6
+        pipeline.poll()
+        self.assertEqual([b'AT+CMSG="2"\n'], self.port.written)
+        self.assertFalse(third.done())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
 import unittest
 import tempfile
 import os
-from configs import parse_serial_config, parse_string_config
+from configs import parse_serial_config, parse_string_config, parse_numeric_config, parse_section_config, \
+    parse_list_config
 import serial
 from xml.etree import ElementTree
 
@@ -17,6 +18,20 @@ CONFIG_XML = """<?xml version="1.0"?>
         <timeout>1</timeout>
     </rpi>
     <datalog>/home/postekit/POSTe/data_log.csv</datalog>
+    <radio>
+        <spreadingfactor>7</spreadingfactor>
+        <dutycycle>0.01</dutycycle>
+    </radio>
+    <registers>
+        <channel>
+            <name>water_level</name>
+            <address>0</address>
+        </channel>
+        <channel>
+            <name>rain</name>
+            <address>12</address>
+        </channel>
+    </registers>
 </config>
 """
 
@@ -50,6 +65,21 @@ class TestConfigReader(unittest.TestCase):
         except Exception as e:
             self.fail(f"read_config raised an exception unexpectedly: {e}")
 
+    def test_read_numeric_config(self):
+        config = parse_numeric_config(self.temp_file.name, 'radio')
+        self.assertEqual({'spreadingfactor': 7, 'dutycycle': 0.01}, config)
+        self.assertIsInstance(config['spreadingfactor'], int)
+        self.assertEqual({}, parse_numeric_config(self.temp_file.name, 'missing'))
+
+    def test_read_section_config(self):
+        self.assertEqual({'spreadingfactor': '7', 'dutycycle': '0.01'}, parse_section_config(self.temp_file.name, 'radio'))
+        self.assertEqual({}, parse_section_config(self.temp_file.name, 'missing'))
+
+    def test_read_list_config(self):
+        self.assertEqual([{'name': 'water_level', 'address': '0'}, {'name': 'rain', 'address': '12'}],
+                         parse_list_config(self.temp_file.name, 'registers'))
+        self.assertEqual([], parse_list_config(self.temp_file.name, 'missing'))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from data import DataSource
+from health import DeviceHealth, BreakerState
+from tests.test_commands import FakeClock
+
+
+class TestDeviceHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.events = []
+        self.health = DeviceHealth(DataSource.DIGITAL_STAFF_GAUGE, failure_threshold=3, backoff_base=60.0,
+                                   backoff_max=200.0, listeners=[self.events.append], clock=self.clock)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.health.allow_request())
+            self.health.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.health.record_success()
+        self.fail(2)
+        self.assertEqual(BreakerState.CLOSED, self.health.state)
+        self.fail(1)
+        self.assertEqual(BreakerState.OPEN, self.health.state)
+        self.assertFalse(self.health.allow_request())
+        self.assertEqual(1, len(self.events))
+        self.assertEqual(BreakerState.CLOSED, self.events[0].previous)
+        self.assertEqual(BreakerState.OPEN, self.events[0].state)
+
+    def test_probe_backoff_doubles_and_caps(self):
+        self.fail(3)
+        self.assertEqual(60.0, self.health.probe_at)
+
+        self.clock.now = 60.0
+        self.fail(1)  # failed probe from half-open
+        self.assertEqual(BreakerState.OPEN, self.health.state)
+        self.assertEqual(180.0, self.health.probe_at)
+
+        self.clock.now = 180.0
+        self.fail(1)
+        self.assertEqual(380.0, self.health.probe_at)  # capped at 200s
+
+    def test_successful_probe_closes(self):
+        self.fail(3)
+        self.clock.now = 60.0
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(BreakerState.HALF_OPEN, self.health.state)
+        self.health.record_success()
+        self.assertEqual(BreakerState.CLOSED, self.health.state)
+        self.assertEqual([BreakerState.OPEN, BreakerState.HALF_OPEN, BreakerState.CLOSED],
+                         [event.state for event in self.events])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from commands import CommandPipeline, CommandStatus
+from join import JoinManager, JoinState
+from tests.test_commands import FakePort, FakeClock
+
+
+JOINED_REPLY = ('+JOIN: Start', '+JOIN: NORMAL', '+JOIN: Network joined',
+                '+JOIN: NetID 000024 DevAddr 48:00:00:01', '+JOIN: Done')
+FAILED_REPLY = ('+JOIN: Start', '+JOIN: NORMAL', '+JOIN: Join failed', '+JOIN: Done')
+
+
+class TestJoinManager(unittest.TestCase):
+
+    def setUp(self):
+        self.port = FakePort()
+        self.clock = FakeClock()
+        self.pipeline = CommandPipeline(self.port, clock=self.clock)
+        self.manager = JoinManager(self.pipeline, backoff_base=10.0, jitter=0.5, min_samples=3,
+                                   rejoin_ratio=0.6, clock=self.clock, rand=lambda: 1.0)
+
+    def reply_to_join(self, *lines):
+        self.pipeline.poll()  # sends AT+JOIN
+        self.port.reply(*lines)
+        self.pipeline.poll()
+
+    def test_joined_from_replies(self):
+        future = self.manager.maintain()
+        self.assertIsNone(future)  # IDLE, `join()` is used at start-up
+
+        self.manager.state = JoinState.FAILED
+        future = self.manager.maintain()
+        self.reply_to_join(*JOINED_REPLY)
+        self.assertEqual(CommandStatus.ACK, future.result(timeout=0).status)
+        self.assertEqual(JoinState.JOINED, self.manager.state)
+        self.assertEqual('48:00:00:01', self.manager.dev_addr)
+        self.assertEqual(b'AT+JOIN\n', self.port.written[0])
+
+    def test_failed_join_backs_off_with_jitter(self):
+        self.manager.state = JoinState.FAILED
+        self.manager.maintain()
+        self.reply_to_join(*FAILED_REPLY)
+        self.assertEqual(JoinState.FAILED, self.manager.state)
+        self.assertEqual(10.0, self.manager.retry_at)  # base 10s, rand() of 1.0 adds the full jitter
+
+        self.assertIsNone(self.manager.maintain())
+        self.clock.now = 10.0
+        self.assertIsNotNone(self.manager.maintain())
+        self.reply_to_join(*FAILED_REPLY)
+        self.assertEqual(2, self.manager.failures)
+        self.assertEqual(30.0, self.manager.retry_at)  # backoff doubled to 20s
+
+    def test_rejoin_only_when_uplinks_fail(self):
+        self.manager.state = JoinState.JOINED
+        self.manager.record_uplink(CommandStatus.NACK)
+        self.manager.record_uplink(CommandStatus.BUSY)  # ignored
+        self.manager.record_uplink(CommandStatus.DROPPED)  # never sent, ignored too
+        self.manager.record_uplink(CommandStatus.ACK)
+        self.assertIsNone(self.manager.maintain())
+
+        self.manager.record_uplink(CommandStatus.TIMEOUT)
+        self.manager.record_uplink(CommandStatus.NACK)
+        self.assertEqual(0.75, self.manager.failure_rate)
+        self.assertIsNotNone(self.manager.maintain())
+        self.assertEqual(JoinState.JOINING, self.manager.state)
+
+    def test_blocking_join_gives_up(self):
+        waits = []
+
+        def wait(seconds):
+            waits.append(seconds)
+
+        # every attempt gets a failed reply as soon as AT+JOIN is written
+        write = self.port.write
+
+        def reply_on_write(data):
+            write(data)
+            self.port.reply(*FAILED_REPLY)
+        self.port.write = reply_on_write
+        self.pipeline.start(interval=0.001)
+        try:
+            self.assertFalse(self.manager.join(max_attempts=2, wait=wait))
+        finally:
+            self.pipeline.stop()
+        self.assertEqual(2, len(self.port.written))
+        self.assertEqual([10.0], waits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,32 @@
+import os
+import struct
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import MagicMock, patch
 
+from crccheck.crc import Crc16Modbus
+
 import main
+from airtime import Priority
 from data import DataSource
+from registers import RegisterChannel, plan_reads
+from ring import Reading, ReadingRing, FLAG_UPLINK
+from state import RuntimeState, StateFile
+from tuning import RuntimeConfig
+
+# the register map config.xml ships commented out
+DSG_PLANS = plan_reads([RegisterChannel('water_level', DataSource.DIGITAL_STAFF_GAUGE, 'cm', 1, 0, '5.0')])
+DRRG_PLANS = plan_reads([
+    RegisterChannel('rain', DataSource.DIGITAL_RAIN_GAUGE, 'mm', 1, 12, '4.2', 'float32', 'CDAB'),
+    RegisterChannel('rain_accu', DataSource.DIGITAL_RAIN_GAUGE, 'mm', 1, 14, '4.17', 'float32', 'CDAB'),
+])
+
+
+
+def modbus_response(registers: bytes) -> bytes:
+    body = bytes((1, 3, len(registers))) + registers
+    return body + Crc16Modbus.calc(body).to_bytes(2, 'little')
 
 
 class TestMain(unittest.TestCase):
@@ -29,25 +52,25 @@ class TestMain(unittest.TestCase):
         crc_value = main.do_crc_check(data)
         self.assertIsInstance(crc_value, int)
 
-    @patch("main.write_to_serial")
-    def test_setup_raises_if_port_closed(self, mock_write):
+    def test_setup_raises_if_port_closed(self):
         mock_lora = MagicMock()
         mock_lora.is_open = False
+        mock_join = MagicMock()
 
         with self.assertRaises(Exception):
-            main.setup(mock_lora)
+            main.setup(mock_lora, mock_join)
 
-        mock_write.assert_not_called()
+        mock_join.join.assert_not_called()
 
-    @patch("main.write_to_serial")
-    def test_setup_sends_join_when_open(self, mock_write):
+    def test_setup_joins_when_open(self):
         mock_lora = MagicMock()
         mock_lora.is_open = True
-        mock_lora.in_waiting = 0  # no reply branch
+        mock_join = MagicMock()
+        mock_join.join.return_value = True
 
-        main.setup(mock_lora)
+        main.setup(mock_lora, mock_join)
 
-        mock_write.assert_called_once_with(mock_lora, main.AT.JOIN)
+        mock_join.join.assert_called_once_with()
 
     @patch("main.get_data_from_port")
     @patch("main.do_crc_check", return_value=0)
@@ -100,6 +123,222 @@ class TestMain(unittest.TestCase):
         self.assertTrue(has_error)
         self.assertIsNone(data.data[0].datum)
 
+    def test_get_register_data_success(self):
+        [plan] = DRRG_PLANS
+        body = b'\x01\x03\x08' + bytes((0x00, 0x00, 0x3F, 0xC0)) + bytes((0x00, 0x00, 0x41, 0xA2))  # 1.5, 20.25
+        port = MagicMock()
+        port.read.return_value = body + Crc16Modbus.calc(body).to_bytes(2, 'little')
+
+        data, has_error = main.get_register_data([plan], DataSource.DIGITAL_RAIN_GAUGE, datetime.now(), port)
+
+        self.assertFalse(has_error)
+        port.write.assert_called_once_with(plan.request)
+        port.read.assert_called_once_with(13)
+        self.assertEqual([1.5, 20.25], data.get_datum())
+
+    @patch("main.do_crc_check", return_value=123)  # CRC fails
+    def test_get_register_data_crc_fail(self, mock_crc):
+        plans = DSG_PLANS
+        port = MagicMock()
+        port.read.return_value = bytes(7)
+        data, has_error = main.get_register_data(plans, DataSource.DIGITAL_STAFF_GAUGE, datetime.now(), port)
+
+        self.assertTrue(has_error)
+        self.assertEqual([None], data.get_datum())
+
+    def test_get_register_data_no_comm(self):
+        plans = DRRG_PLANS
+        port = MagicMock()
+        port.read.return_value = b''
+        data, has_error = main.get_register_data(plans, DataSource.DIGITAL_RAIN_GAUGE, datetime.now(), port)
+
+        self.assertTrue(has_error)
+        self.assertEqual([None, None], data.get_datum())
+
+    @patch("main.get_data_from_port")
+    def test_legacy_and_mapped_drrg_decodes_differ(self, mock_port):
+        # 1.2345 and 20.25 as CDAB floats in registers 12 and 14 of the 16 the legacy request reads
+        rain, accu = struct.pack('>f', 1.2345), struct.pack('>f', 20.25)
+        registers = bytes(24) + rain[2:] + rain[:2] + accu[2:] + accu[:2]
+        mock_port.return_value = modbus_response(registers)
+        legacy, has_error = main.get_drrg_data(datetime.now(), port=MagicMock())
+        self.assertFalse(has_error)
+
+        # the legacy reader only keeps bytes A and C of each float, B and D read as zero
+        self.assertEqual([struct.unpack('>f', bytes((value[0], 0, value[2], 0)))[0] for value in (rain, accu)],
+                         legacy.get_datum())
+        self.assertEqual([0.50006103515625, 8.0], legacy.get_datum())
+
+        [plan] = DRRG_PLANS
+        mapped = plan.decode(modbus_response(registers[24:]))
+        self.assertAlmostEqual(1.2345, mapped['rain'], places=6)
+        self.assertEqual(20.25, mapped['rain_accu'])
+
+    def test_get_sensor_reader(self):
+        with patch.dict(main.SENSOR_PLANS, clear=True):
+            self.assertIs(main.get_dsg_data, main.get_sensor_reader(DataSource.DIGITAL_STAFF_GAUGE))
+        with patch.dict(main.SENSOR_PLANS, {DataSource.DIGITAL_STAFF_GAUGE: DSG_PLANS}):
+            reader = main.get_sensor_reader(DataSource.DIGITAL_STAFF_GAUGE)
+        self.assertEqual(main.get_register_data, reader.func)
+
+    def test_read_device_skips_open_breaker(self):
+        health = MagicMock()
+        health.source = DataSource.DIGITAL_RAIN_GAUGE
+        health.allow_request.return_value = False
+        reader = MagicMock()
+
+        data = main.read_device(health, reader, datetime.now(), MagicMock())
+
+        reader.assert_not_called()
+        self.assertEqual(2, len(data.data))
+        self.assertIsNone(data.data[0].datum)
+
+    def test_read_device_records_failure(self):
+        health = MagicMock()
+        health.allow_request.return_value = True
+        now = datetime.now()
+        reader = MagicMock(return_value=(main.get_null_data(DataSource.DIGITAL_STAFF_GAUGE, now), True))
+
+        main.read_device(health, reader, now, MagicMock())
+
+        health.record_failure.assert_called_once_with()
+        health.record_success.assert_not_called()
+
+    def test_schedule_tick(self):
+        state = RuntimeState(loops_since_cmsg=0, next_midnight=datetime(2025, 9, 23))
+
+        rotate_at, uplink = main.schedule_tick(state, datetime(2025, 9, 22, 23, 59), RuntimeConfig())
+        self.assertIsNone(rotate_at)
+        self.assertFalse(uplink)
+
+        rotate_at, uplink = main.schedule_tick(state, datetime(2025, 9, 25, 8, 0), RuntimeConfig())  # resumed days later
+        self.assertEqual(datetime(2025, 9, 23), rotate_at)
+        self.assertTrue(uplink)
+        self.assertEqual(datetime(2025, 9, 26), state.next_midnight)
+        self.assertEqual(0, state.loops_since_cmsg)
+        self.assertEqual(1, state.uplink_count)
+
+    def test_schedule_tick_uplink_interval(self):
+        state = RuntimeState(next_midnight=datetime(2025, 9, 23))
+        config = RuntimeConfig(uplink_interval=3)
+        uplinks = [main.schedule_tick(state, datetime(2025, 9, 22, 12), config)[1] for _ in range(6)]
+        self.assertEqual([False, False, True, False, False, True], uplinks)
+
+    def test_read_device_disabled(self):
+        health = MagicMock()
+        health.source = DataSource.DIGITAL_STAFF_GAUGE
+        reader = MagicMock()
+
+        data = main.read_device(health, reader, datetime.now(), MagicMock(), enabled=False)
+
+        reader.assert_not_called()
+        health.allow_request.assert_not_called()
+        self.assertIsNone(data.data[0].datum)
+
+    @patch("main.log_burst_stats")
+    def test_acquire_burst(self, mock_log):
+        dsg_health, drrg_health = MagicMock(), MagicMock()
+        dsg_health.source = DataSource.DIGITAL_STAFF_GAUGE
+        drrg_health.source = DataSource.DIGITAL_RAIN_GAUGE
+        levels = iter([100.0, 250.0, 101.0])
+
+        def get_reader(source):
+            if source == DataSource.DIGITAL_STAFF_GAUGE:
+                return lambda now, port: (main.SensorData(source, 'cm', now, [main.RawData('5.0', next(levels))]),
+                                          False)
+            return lambda now, port: (main.get_null_data(source, now), True)
+
+        with patch("main.get_sensor_reader", side_effect=get_reader):
+            payload = main.acquire(datetime.now(), RuntimeConfig(), (dsg_health, MagicMock()),
+                                   (drrg_health, MagicMock()), main.BurstSettings(samples=3))
+
+        self.assertEqual([100.5, None, None], payload.get_csv_format(None)[1:])  # 250 rejected
+        dsg_health.record_success.assert_called_once_with()
+        drrg_health.record_failure.assert_called_once_with()  # once per burst, not per read
+        self.assertEqual(2, mock_log.call_args[0][1].accepted)
+
+    def test_compile_reading(self):
+        the_time = datetime(2025, 9, 22, 12, 30)
+        reading = Reading(1, the_time.timestamp(), 0.0, FLAG_UPLINK, (12.0, None, 1.5))
+        now, payload = main.compile_reading(reading)
+        self.assertEqual(the_time, now)
+        self.assertEqual([the_time, 12.0, None, 1.5], payload.get_csv_format(now))
+        self.assertTrue(payload.get_full_payload(now).startswith('123000012######'))
+
+    @patch("main.sleep")
+    @patch("main.open_storage")
+    def test_run_logger_stores_readings_published_before_it_started(self, mock_open_storage, mock_sleep):
+        ring = ReadingRing.create(8, len(main.CHANNELS))
+        try:
+            the_time = datetime(2025, 9, 22, 12, 30)
+            ring.publish(the_time.timestamp(), [12.0] + [None] * (len(main.CHANNELS) - 1))
+            stop = MagicMock()
+            stop.is_set.side_effect = [False, True]
+            main.run_logger(ring, stop)
+        finally:
+            ring.close()
+        storage = mock_open_storage.return_value
+        storage.write.assert_called_once()
+        self.assertEqual(the_time, storage.write.call_args[0][0])
+        storage.close.assert_called_once_with()
+
+    @patch("main.sleep")
+    @patch("main.send_uplink")
+    @patch("main.TuningStore")
+    @patch("main.open_lora")
+    def test_run_uplink_sends_readings_flagged_while_joining(self, mock_open_lora, mock_tuning, mock_send_uplink,
+                                                             mock_sleep):
+        ring = ReadingRing.create(8, len(main.CHANNELS))
+        values = [12.0] + [None] * (len(main.CHANNELS) - 1)
+
+        def join(tuning):  # the acquisition loop keeps publishing while the node joins
+            ring.publish(datetime(2025, 9, 22, 12, 31).timestamp(), values, flags=FLAG_UPLINK)
+            return MagicMock(), MagicMock(), MagicMock()
+
+        mock_open_lora.side_effect = join
+        mock_tuning.return_value.confirmation.return_value = ''
+        try:
+            ring.publish(datetime(2025, 9, 22, 12, 30).timestamp(), values, flags=FLAG_UPLINK)
+            stop = MagicMock()
+            stop.is_set.side_effect = [False, True]
+            main.run_uplink(ring, stop)
+        finally:
+            ring.close()
+        self.assertEqual(2, mock_send_uplink.call_count)
+
+    def test_get_stopped_consumers(self):
+        logger, uplink = MagicMock(), MagicMock()
+        logger.name, uplink.name = 'logger', 'uplink'
+        logger.is_alive.return_value = False
+        uplink.is_alive.return_value = True
+        self.assertEqual(['logger'], main.get_stopped_consumers([logger, uplink]))
+
+    def test_failed_rotation_is_not_replayed_after_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'state.bin')
+            state_file = StateFile(path)
+            state = RuntimeState(next_midnight=datetime(2025, 9, 23))
+            now = datetime(2025, 9, 23, 0, 1)
+            rotate_at, _ = main.schedule_tick(state, now, RuntimeConfig())
+            state_file.save(state)  # as the loops do before rotating
+            storage = MagicMock()
+            storage.rotate.side_effect = FileNotFoundError('data_log.csv')
+            main.rotate_storage(storage, rotate_at)  # only printed
+            state_file.close()
+
+            resumed = StateFile(path)
+            rotate_at, _ = main.schedule_tick(resumed.load(), now + timedelta(minutes=1), RuntimeConfig())
+            resumed.close()
+        self.assertIsNone(rotate_at)
+
+    @patch("main.ALERT_LEVEL", 20.0)
+    def test_get_priority(self):
+        the_time = datetime(2025, 9, 22, 12, 30)
+        _, payload = main.compile_reading(Reading(1, the_time.timestamp(), 0.0, 0, (12.0, 30.0, 1.5)))
+        self.assertEqual(Priority.ROUTINE, main.get_priority(payload))
+        _, payload = main.compile_reading(Reading(1, the_time.timestamp(), 0.0, 0, (25.0, None, None)))
+        self.assertEqual(Priority.ALERT, main.get_priority(payload))
+
     def test_get_next_midnight(self):
         now = datetime(2025, 9, 22, 10, 30, 15)
         midnight = main.get_next_midnight(now)
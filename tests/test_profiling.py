@@ -0,0 +1,120 @@
+import csv
+import os
+import pstats
+import signal
+import tempfile
+import tracemalloc
+import unittest
+
+from profiling import Profiler, get_rss
+
+
+def allocate(leak):
+    leak.append(bytearray(4096))
+
+
+def busy_cycle(profiler, leak):
+    profiler.begin_cycle()
+    allocate(leak)
+    profiler.end_cycle()
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def files(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_idle_profiler_writes_nothing(self):
+        profiler = Profiler(self.directory.name, rss_interval=0)
+        leak = []
+        for _ in range(5):
+            busy_cycle(profiler, leak)
+        self.assertFalse(profiler.active)
+        self.assertEqual([], self.files())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_session_writes_profile_and_snapshots(self):
+        profiler = Profiler.from_config({'enabled': 1, 'cycles': 4, 'snapshotinterval': 2, 'rssinterval': 0},
+                                        directory=self.directory.name)
+        leak = []
+        busy_cycle(profiler, leak)
+        self.assertTrue(profiler.active)
+        for _ in range(3):
+            busy_cycle(profiler, leak)
+        self.assertFalse(profiler.active)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        files = self.files()
+        self.assertEqual(3, len(files))
+        [prof] = [name for name in files if name.endswith('.prof')]
+        functions = {function for _, _, function in pstats.Stats(os.path.join(self.directory.name, prof)).stats}
+        self.assertIn('allocate', functions)
+
+        [snapshots] = [name for name in files if name.startswith('tracemalloc_')]
+        with open(os.path.join(self.directory.name, snapshots)) as f:
+            text = f.read()
+        self.assertEqual(2, text.count('top growth'))
+        self.assertIn('test_profiling.py', text)  # the growing list is attributed to its line
+
+    def test_signal_requests_a_session(self):
+        profiler = Profiler(self.directory.name, cycles=1, rss_interval=0)
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            profiler.install_signal()
+            os.kill(os.getpid(), signal.SIGUSR1)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        self.assertTrue(profiler.requested)
+        busy_cycle(profiler, [])
+        self.assertFalse(profiler.requested)
+        self.assertTrue(any(name.endswith('.prof') for name in self.files()))
+
+    def test_ignore_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            Profiler.ignore_signal()
+            os.kill(os.getpid(), signal.SIGUSR1)  # would terminate the test run with the default action
+            self.assertEqual(signal.SIG_IGN, signal.getsignal(signal.SIGUSR1))
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_rss_log(self):
+        profiler = Profiler(self.directory.name, rss_interval=2)
+        for _ in range(4):
+            busy_cycle(profiler, [])
+        with open(os.path.join(self.directory.name, 'rss_log.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(['2', '4'], [row[1] for row in rows])
+        self.assertGreater(int(rows[-1][2]), 0)
+
+    def test_unwritable_directory_does_not_stop_the_loop(self):
+        missing = os.path.join(self.directory.name, 'missing')
+        profiler = Profiler.from_config({'enabled': 1, 'cycles': 2, 'snapshotinterval': 1, 'rssinterval': 1},
+                                        directory=missing)
+        for _ in range(3):
+            busy_cycle(profiler, [])
+        self.assertFalse(profiler.active)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertFalse(os.path.exists(missing))
+
+    def test_from_config_rejects_invalid_intervals(self):
+        for config in ({'snapshotinterval': 0}, {'cycles': 0}, {'top': 0}, {'rssinterval': -1}):
+            with self.assertRaises(ValueError):
+                Profiler.from_config(config, directory=self.directory.name)
+        self.assertEqual(0, Profiler.from_config({'rssinterval': 0}, directory=self.directory.name).rss_interval)
+
+    def test_get_rss(self):
+        peak, current = get_rss()
+        self.assertGreater(peak, 0)
+        if current is not None:  # no /proc outside Linux
+            self.assertGreater(current, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
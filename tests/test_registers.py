@@ -0,0 +1,111 @@
+import math
+import os
+import struct
+import tempfile
+import unittest
+
+from crccheck.crc import Crc16Modbus
+
+from capture import FrameCapture, decode_capture
+from data import DataSource
+from registers import RegisterChannel, ReadPlan, build_read_request, plan_reads, group_by_source, \
+    READ_INPUT_REGISTERS
+
+
+def channel(name, address, type='uint16', slave=1, **kwargs):
+    return RegisterChannel(name, DataSource.DIGITAL_RAIN_GAUGE, 'mm', slave, address, '4.2', type, **kwargs)
+
+
+def response(plan: ReadPlan, registers: bytes) -> bytes:
+    body = bytes((plan.slave, plan.function, len(registers))) + registers
+    return body + Crc16Modbus.calc(body).to_bytes(2, 'little')
+
+
+class TestRegisterChannel(unittest.TestCase):
+
+    def test_from_config(self):
+        parsed = RegisterChannel.from_config({'name': 'rain', 'source': 'DRRG', 'unit': 'mm', 'slave': '2',
+                                              'address': '0x0C', 'type': 'float32', 'wordorder': 'CDAB',
+                                              'scale': '0.1', 'format': '4.2'})
+        self.assertEqual(channel('rain', 12, 'float32', slave=2, word_order='CDAB', scale=0.1), parsed)
+        self.assertEqual(2, parsed.count)
+
+    def test_from_config_defaults(self):
+        parsed = RegisterChannel.from_config({'name': 'level', 'source': 'DSG', 'address': '0', 'format': '5.0'})
+        self.assertEqual(('uint16', 1, 1.0, 'ABCD'), (parsed.type, parsed.slave, parsed.scale, parsed.word_order))
+
+    def test_from_config_invalid(self):
+        with self.assertRaises(ValueError):
+            RegisterChannel.from_config({'name': 'level', 'source': 'DSG', 'format': '5.0'})  # no address
+        with self.assertRaises(ValueError):
+            RegisterChannel.from_config({'name': 'level', 'source': 'DSG', 'address': '0', 'format': '5.0',
+                                         'type': 'uint64'})
+
+    def test_group_by_source(self):
+        dsg = RegisterChannel('level', DataSource.DIGITAL_STAFF_GAUGE, 'cm', 1, 0, '5.0')
+        groups = group_by_source([channel('rain', 12), dsg, channel('accu', 14)])
+        self.assertEqual([DataSource.DIGITAL_RAIN_GAUGE, DataSource.DIGITAL_STAFF_GAUGE], list(groups))
+        self.assertEqual(['rain', 'accu'], [c.name for c in groups[DataSource.DIGITAL_RAIN_GAUGE]])
+
+
+class TestPlanReads(unittest.TestCase):
+
+    def spans(self, plans):
+        return [(plan.slave, plan.start, plan.count) for plan in plans]
+
+    def test_adjacent_registers_are_one_read(self):
+        plans = plan_reads([channel('accu', 14, 'float32'), channel('rain', 12, 'float32')])
+        self.assertEqual([(1, 12, 4)], self.spans(plans))
+        self.assertEqual(['rain', 'accu'], [c.name for c in plans[0].channels])
+        self.assertEqual(13, plans[0].response_length)
+
+    def test_nearby_registers_are_merged(self):
+        self.assertEqual([(1, 0, 7)], self.spans(plan_reads([channel('a', 0), channel('b', 6)], max_gap=5)))
+        self.assertEqual([(1, 0, 1), (1, 6, 1)],
+                         self.spans(plan_reads([channel('a', 0), channel('b', 6)], max_gap=4)))
+
+    def test_read_size_limit(self):
+        self.assertEqual([(1, 0, 1), (1, 3, 1)],
+                         self.spans(plan_reads([channel('a', 0), channel('b', 3)], max_count=3)))
+
+    def test_slaves_and_functions_are_separate(self):
+        plans = plan_reads([channel('a', 0), channel('b', 1, slave=2),
+                            channel('c', 2, function=READ_INPUT_REGISTERS)])
+        self.assertEqual([(1, 3), (1, 4), (2, 3)], [(plan.slave, plan.function) for plan in plans])
+
+    def test_overlapping_channels(self):
+        self.assertEqual([(1, 0, 2)], self.spans(plan_reads([channel('both', 0, 'float32'), channel('high', 0)])))
+
+    def test_request_frame(self):
+        plan = plan_reads([RegisterChannel('level', DataSource.DIGITAL_STAFF_GAUGE, 'cm', 1, 0, '5.0')])[0]
+        self.assertEqual(b'\x01\x03\x00\x00\x00\x01\x84\x0A', plan.request)
+
+
+class TestReadPlan(unittest.TestCase):
+
+    def setUp(self):
+        [self.plan] = plan_reads([channel('rain', 12, 'float32', word_order='CDAB'),
+                                  channel('count', 14, 'int16', scale=0.5)])
+        a, b, c, d = struct.pack('>f', 1.25)
+        self.frame = response(self.plan, bytes((c, d, a, b)) + struct.pack('>h', -7))
+
+    def test_decode(self):
+        self.assertEqual({'rain': 1.25, 'count': -3.5}, self.plan.decode(self.frame))
+
+    def test_layout_decodes_captures(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'capture.bin')
+            frame_capture = FrameCapture(path)
+            frame_capture.record(1.0, DataSource.DIGITAL_RAIN_GAUGE, self.plan.request, self.frame)
+            frame_capture.record(2.0, DataSource.DIGITAL_RAIN_GAUGE, build_read_request(1, 3, 0, 16), self.frame)
+            frame_capture.close()
+            with open(path, 'rb') as f:
+                decoded = decode_capture(f.read(), DataSource.DIGITAL_RAIN_GAUGE, layout=self.plan.layout())
+        self.assertEqual([1.0], list(decoded.timestamps))  # only the responses to the planned request
+        self.assertEqual(1.25, decoded.channels['rain'][0])
+        self.assertEqual(-7, decoded.channels['count'][0])  # unscaled
+        self.assertFalse(math.isnan(decoded.channels['count'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
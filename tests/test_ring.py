@@ -0,0 +1,44 @@
+import unittest
+
+from ring import ReadingRing, RingReader, FLAG_UPLINK
+
+
+class TestReadingRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = ReadingRing.create(capacity=4, channels=3)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_publish_and_read(self):
+        reader = RingReader(self.ring)
+        self.ring.publish(100.0, [1.0, None, 2.5], flags=FLAG_UPLINK)
+        readings = reader.read()
+        self.assertEqual(1, len(readings))
+        self.assertEqual(1, readings[0].sequence)
+        self.assertEqual(100.0, readings[0].timestamp)
+        self.assertEqual((1.0, None, 2.5), readings[0].values)
+        self.assertTrue(readings[0].flags & FLAG_UPLINK)
+        self.assertEqual([], reader.read())
+
+    def test_readers_keep_their_own_pace(self):
+        fast, slow = RingReader(self.ring), RingReader(self.ring)
+        for i in range(3):
+            self.ring.publish(float(i), [i, i, i])
+            self.assertEqual(1, len(fast.read()))
+        self.assertEqual([1, 2], [reading.sequence for reading in slow.read(max_records=2)])
+        self.assertEqual([3], [reading.sequence for reading in slow.read()])
+
+    def test_overrun_detection(self):
+        reader = RingReader(self.ring)
+        for i in range(6):
+            self.ring.publish(float(i), [i, i, i])
+        readings = reader.read()
+        self.assertEqual([3, 4, 5, 6], [reading.sequence for reading in readings])
+        self.assertEqual(2, reader.overruns)
+        self.assertEqual(0, reader.lag)
+
+
+if __name__ == '__main__':
+    unittest.main()
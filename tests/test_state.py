@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from state import StateFile, RuntimeState, SLOT_SIZE
+
+
+class TestStateFile(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'state.bin')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_new_file_has_no_state(self):
+        state_file = StateFile(self.path)
+        self.assertIsNone(state_file.load())
+        state_file.close()
+        self.assertEqual(2 * SLOT_SIZE, os.path.getsize(self.path))
+
+    def test_resume_latest_state(self):
+        midnight = datetime(2025, 9, 23)
+        state_file = StateFile(self.path)
+        state_file.save(RuntimeState(loops_since_cmsg=1, uplink_count=4, next_midnight=midnight))
+        state_file.save(RuntimeState(loops_since_cmsg=0, uplink_count=5, next_midnight=midnight,
+                                     last_tick=datetime(2025, 9, 22, 23, 59)))
+        state_file.close()
+
+        reopened = StateFile(self.path)
+        state = reopened.load()
+        self.assertEqual(RuntimeState(0, 5, midnight, datetime(2025, 9, 22, 23, 59)), state)
+        self.assertEqual(2, reopened.sequence)
+        reopened.close()
+
+    def test_torn_write_falls_back_to_other_slot(self):
+        state_file = StateFile(self.path)
+        state_file.save(RuntimeState(loops_since_cmsg=1))
+        state_file.save(RuntimeState(loops_since_cmsg=2))
+        state_file.close()
+
+        with open(self.path, 'r+b') as f:  # corrupt the slot of sequence 2
+            f.seek(0 + 20)
+            f.write(b'\xff')
+
+        reopened = StateFile(self.path)
+        self.assertEqual(1, reopened.load().loops_since_cmsg)
+        reopened.save(RuntimeState(loops_since_cmsg=3))  # overwrites the corrupted slot
+        self.assertEqual(3, reopened.load().loops_since_cmsg)
+        reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
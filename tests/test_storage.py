@@ -0,0 +1,158 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from data import CompiledSensorData, DataSource, RawData, SensorData, FLOOD_FORMAT, RAIN_DATA_FORMAT, \
+    RAIN_ACCU_FORMAT
+from storage import CsvStorage, SqliteStorage, get_partition, open_storage
+
+
+COLUMNS = [('DSG', 0), ('DRRG', 0), ('DRRG', 1)]
+
+
+def make_payload(now, level, rain, accu):
+    return CompiledSensorData([
+        SensorData(DataSource.DIGITAL_STAFF_GAUGE, 'cm', now, [RawData(FLOOD_FORMAT, level)]),
+        SensorData(DataSource.DIGITAL_RAIN_GAUGE, 'mm', now,
+                   [RawData(RAIN_DATA_FORMAT, rain), RawData(RAIN_ACCU_FORMAT, accu)]),
+    ])
+
+
+class TestCsvStorage(unittest.TestCase):
+
+    def test_rotation_resumed_after_failing_partway(self):
+        with tempfile.TemporaryDirectory() as directory:
+            data_path = os.path.join(directory, 'data_log.csv')
+            event_path = os.path.join(directory, 'event_log.csv')  # no events were logged that day
+            with open(data_path, 'w') as f:
+                f.write('2025-01-02 00:00:30,100.0,,12.3456\n')
+            storage = CsvStorage(data_path)
+            with patch('logs.DATA_LOG_PATH', data_path), patch('logs.EVENT_LOG_PATH', event_path):
+                storage.rotate(datetime(2025, 1, 3))
+                storage.rotate(datetime(2025, 1, 3))  # replayed after a restart, everything is renamed already
+            self.assertEqual(['data_log_01-02-25.csv'], os.listdir(directory))
+
+
+class TestSqliteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'readings.sqlite')
+        self.storage = SqliteStorage(self.path, COLUMNS, retention_days=2, flush_interval=0.01)
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_write_and_query(self):
+        start = datetime(2025, 1, 2, 10, 0)
+        for minute in range(3):
+            now = start + timedelta(minutes=minute)
+            self.storage.write(now, make_payload(now, 10 + minute, 0.5, None))
+        self.storage.flush()
+
+        rows = self.storage.query(start, start + timedelta(minutes=2))
+        self.assertEqual(6, len(rows))  # two readings of three channels
+        self.assertEqual([start.timestamp()] * 3, [row[0] for row in rows[:3]])
+        dsg = self.storage.query(start, start + timedelta(minutes=2), source='DSG')
+        self.assertEqual([10.0, 11.0], [row[3] for row in dsg])
+        self.assertEqual({('DSG', 0)}, {row[1:3] for row in dsg})
+        self.assertIn((start.timestamp(), 'DRRG', 1, None), rows)
+
+    def test_failed_batch_keeps_writer_running(self):
+        now = datetime(2025, 1, 2, 10, 0)
+        self.storage._queue.put(('insert', now.date(), [(now.timestamp(), 'DSG', 0, object())]))  # cannot be bound
+        self.storage.flush()
+
+        self.storage.write(now, make_payload(now, 10, 0.5, 1.0))
+        self.storage.flush()
+        self.assertEqual(3, len(self.storage.query(now, now + timedelta(minutes=1))))
+
+    def test_query_reads_only_partitions_in_range(self):
+        first = datetime(2025, 1, 2, 23, 59)
+        second = datetime(2025, 1, 3, 0, 1)
+        self.storage.write(first, make_payload(first, 1, 0, 0))
+        self.storage.write(second, make_payload(second, 2, 0, 0))
+        self.storage.flush()
+
+        self.assertEqual({get_partition(first.date()), get_partition(second.date())}, self.storage._partitions)
+        with patch.object(self.storage, '_connect', wraps=self.storage._connect) as connect:
+            self.assertEqual([], self.storage.query(datetime(2025, 1, 5), datetime(2025, 1, 6)))
+            connect.assert_not_called()
+        rows = self.storage.query(first, second + timedelta(minutes=1), source='DSG')
+        self.assertEqual([1.0, 2.0], [row[3] for row in rows])
+
+    @patch('storage.rename_event_log_file')
+    def test_rotate_drops_partitions_past_retention(self, rename_event_log_file):
+        for day in (1, 2, 3):
+            now = datetime(2025, 1, day, 12, 0)
+            self.storage.write(now, make_payload(now, day, 0, 0))
+        midnight = datetime(2025, 1, 4)
+        self.storage.rotate(midnight)
+        self.storage.flush()
+
+        rename_event_log_file.assert_called_once_with(midnight)
+        self.assertEqual({'readings_20250102', 'readings_20250103'}, self.storage._partitions)
+        with sqlite3.connect(self.path) as connection:
+            tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertEqual({'readings_20250102', 'readings_20250103'}, tables)
+
+    def test_rotate_without_event_log(self):
+        now = datetime(2025, 1, 1, 12, 0)
+        self.storage.write(now, make_payload(now, 1, 0, 0))
+        event_path = os.path.join(self.directory.name, 'event_log.csv')  # never written
+        with patch('logs.EVENT_LOG_PATH', event_path):
+            self.storage.rotate(datetime(2025, 1, 4))
+        self.storage.flush()
+        self.assertEqual(set(), self.storage._partitions)  # pruned all the same
+
+    @patch('storage.rename_event_log_file', side_effect=PermissionError('event_log.csv'))
+    def test_rotate_prunes_when_event_log_rename_fails(self, rename_event_log_file):
+        now = datetime(2025, 1, 1, 12, 0)
+        self.storage.write(now, make_payload(now, 1, 0, 0))
+        self.storage.rotate(datetime(2025, 1, 4))
+        self.storage.flush()
+        self.assertEqual(set(), self.storage._partitions)
+
+    def test_wal_mode(self):
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual('wal', connection.execute('PRAGMA journal_mode').fetchone()[0])
+
+    def test_existing_partitions_are_found_on_reopen(self):
+        now = datetime(2025, 1, 2, 12, 0)
+        self.storage.write(now, make_payload(now, 5, 0, 0))
+        self.storage.close()
+        self.storage = SqliteStorage(self.path, COLUMNS)
+        self.assertEqual(1, len(self.storage.query(now, now + timedelta(seconds=1), source='DSG')))
+
+    def test_export_csv(self):
+        now = datetime(2025, 1, 2, 12, 0)
+        self.storage.write(now, make_payload(now, 5, 1.25, None))
+        self.storage.flush()
+
+        path = os.path.join(self.directory.name, 'export.csv')
+        self.storage.export_csv(now.date(), path)
+        with open(path, newline='') as f:
+            self.assertEqual([[str(now), '5.0', '1.25', '']], list(csv.reader(f)))
+
+
+class TestOpenStorage(unittest.TestCase):
+
+    def test_defaults_to_csv(self):
+        self.assertIsInstance(open_storage({}, COLUMNS), CsvStorage)
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'backend': 'sqlite', 'sqlitepath': os.path.join(directory, 'r.sqlite'), 'retentiondays': '30'}
+            storage = open_storage(config, COLUMNS)
+            self.assertIsInstance(storage, SqliteStorage)
+            self.assertEqual(30, storage.retention_days)
+            storage.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
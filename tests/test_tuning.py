@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+
+from data import DataSource
+from tuning import parse_downlink, within_deadband, RuntimeConfig, TuningStore, UplinkFilter, TUNING_FPORT, \
+    DEADBAND_HEARTBEAT
+
+
+class TestParseDownlink(unittest.TestCase):
+
+    def test_all_commands(self):
+        config = parse_downlink(RuntimeConfig(), bytes.fromhex('01012C' '0205' '030032' '0401'))
+        self.assertEqual(300, config.sample_interval)
+        self.assertEqual(5, config.uplink_interval)
+        self.assertEqual(0.5, config.deadband)
+        self.assertEqual(frozenset({DataSource.DIGITAL_RAIN_GAUGE}), config.disabled)
+        self.assertFalse(config.is_enabled(DataSource.DIGITAL_RAIN_GAUGE))
+
+    def test_invalid_commands_raise(self):
+        for data in (b'', bytes.fromhex('09'), bytes.fromhex('0101'), bytes.fromhex('010005'),
+                     bytes.fromhex('0200'), bytes.fromhex('0205' '0104')):
+            with self.assertRaises(ValueError, msg=data.hex()):
+                parse_downlink(RuntimeConfig(), data)
+
+    def test_within_deadband(self):
+        self.assertTrue(within_deadband([10.0, 1.0], [10.4, 1.0], 0.5))
+        self.assertFalse(within_deadband([10.0, 1.0], [10.6, 1.0], 0.5))
+        self.assertFalse(within_deadband([10.0, None], [10.0, 1.0], 0.5))
+        self.assertFalse(within_deadband([10.0], [10.0], 0.0))
+
+    def test_uplink_filter_heartbeat(self):
+        uplink_filter = UplinkFilter()
+        allowed = [uplink_filter.allow([1.0], 0.5) for _ in range(DEADBAND_HEARTBEAT + 2)]
+        self.assertEqual([True] + [False] * DEADBAND_HEARTBEAT + [True], allowed)
+
+
+class TestTuningStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'tuning.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_apply_persists_and_confirms(self):
+        store = TuningStore(self.path)
+        self.assertEqual(RuntimeConfig(), store.config)
+        self.assertTrue(store.apply(TUNING_FPORT, bytes.fromhex('01003C0402')))
+        self.assertEqual('C01', store.confirmation())
+        self.assertEqual('', store.confirmation())
+
+        with open(self.path) as f:
+            self.assertEqual(['DSG'], json.load(f)['disabled'])
+
+        reloaded = TuningStore(self.path)
+        self.assertEqual(store.config, reloaded.config)
+        self.assertEqual(1, reloaded.revision)
+
+    def test_rejected_downlink_keeps_config(self):
+        store = TuningStore(self.path)
+        self.assertFalse(store.apply(TUNING_FPORT, bytes.fromhex('0205' '0100')))
+        self.assertEqual(RuntimeConfig(), store.config)
+        self.assertEqual('R00', store.confirmation())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unsaved_downlink_rejected(self):
+        store = TuningStore(os.path.join(self.temp_dir.name, 'missing', 'tuning.json'))
+        self.assertFalse(store.apply(TUNING_FPORT, bytes.fromhex('0203')))
+        self.assertEqual(RuntimeConfig(), store.config)
+        self.assertEqual(0, store.revision)
+        self.assertEqual('R00', store.confirmation())
+
+    def test_other_ports_ignored(self):
+        store = TuningStore(self.path)
+        self.assertFalse(store.apply(TUNING_FPORT + 1, bytes.fromhex('0205')))
+        self.assertEqual('', store.confirmation())
+
+    def test_refresh_picks_up_other_process(self):
+        reader = TuningStore(self.path)
+        writer = TuningStore(self.path)
+        writer.apply(TUNING_FPORT, bytes.fromhex('0203'))
+        reader.refresh()
+        self.assertEqual(3, reader.config.uplink_interval)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+Downlink Driven Runtime Tuning
+"""
+import json
+import os
+import struct
+import threading
+from dataclasses import dataclass, field, replace, asdict
+from typing import Optional
+
+from configs import parse_string_config
+from data import DataSource
+
+
+TUNING_PATH = parse_string_config('config.xml', 'tuningpath')
+
+TUNING_FPORT = 10  # downlinks on any other port are not configuration commands
+
+# opcode: (field, struct format of the value, minimum, maximum)
+OPCODES = {
+    0x01: ('sample_interval', '>H', 10, 3600),   # seconds between readings
+    0x02: ('uplink_interval', '>B', 1, 60),      # readings per uplink
+    0x03: ('deadband', '>H', 0, 65535),          # hundredths of a unit
+    0x04: ('sensor_mask', '>B', 0, 0b11),        # enabled sensors, see `SENSOR_BITS`
+}
+
+SENSOR_BITS = {
+    DataSource.DIGITAL_STAFF_GAUGE: 0b01,
+    DataSource.DIGITAL_RAIN_GAUGE: 0b10,
+}
+
+DEADBAND_HEARTBEAT = 10  # uplink slots the deadband may skip in a row
+
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    sample_interval: int = 60
+    uplink_interval: int = 2
+    deadband: float = 0.0  # an uplink is skipped when no value moved more than this since the last one
+    disabled: frozenset = field(default_factory=frozenset)  # `DataSource`s that are not polled
+
+    def is_enabled(self, source: DataSource) -> bool:
+        return source not in self.disabled
+
+
+def parse_downlink(config: RuntimeConfig, data: bytes) -> RuntimeConfig:
+    """ Applies a downlink of configuration commands, all of them or none.
+
+    Each command is an opcode byte followed by its big-endian value, see `OPCODES`.
+
+    Args:
+        config: `RuntimeConfig` the commands are applied to.
+        data: `bytes` of the downlink.
+    Returns:
+        `RuntimeConfig` with the commands applied.
+    Raises:
+        `ValueError` if an opcode is unknown, a value is truncated or out of range.
+    Example:
+        >>> parse_downlink(RuntimeConfig(), bytes.fromhex('01012C0205')).sample_interval
+        300
+    """
+    if not data:
+        raise ValueError('Empty downlink')
+    changes = {}
+    offset = 0
+    while offset < len(data):
+        opcode = data[offset]
+        if opcode not in OPCODES:
+            raise ValueError('Unknown opcode 0x%02X' % opcode)
+        name, value_format, minimum, maximum = OPCODES[opcode]
+        try:
+            [value] = struct.unpack_from(value_format, data, offset + 1)
+        except struct.error:
+            raise ValueError('Truncated value for %s' % name)
+        if not minimum <= value <= maximum:
+            raise ValueError('%s out of range: %d' % (name, value))
+        changes[name] = value
+        offset += 1 + struct.calcsize(value_format)
+
+    if 'deadband' in changes:
+        changes['deadband'] = changes['deadband'] / 100
+    if 'sensor_mask' in changes:
+        mask = changes.pop('sensor_mask')
+        changes['disabled'] = frozenset(source for source, bit in SENSOR_BITS.items() if not mask & bit)
+    return replace(config, **changes)
+
+
+def within_deadband(values: list[Optional[float]], sent: Optional[list[Optional[float]]], deadband: float) -> bool:
+    """Whether no value moved more than `deadband` since the last uplink, a null that appears or clears counts"""
+    if deadband <= 0 or sent is None or len(values) != len(sent):
+        return False
+    for value, previous in zip(values, sent):
+        if (value is None) != (previous is None):
+            return False
+        if value is not None and abs(value - previous) > deadband:
+            return False
+    return True
+
+
+class UplinkFilter:
+    """Skips uplink slots while the readings stay within the deadband, at most `DEADBAND_HEARTBEAT` in a row"""
+
+    def __init__(self):
+        self.sent: Optional[list[Optional[float]]] = None
+        self.skipped = 0
+
+    def allow(self, values: list[Optional[float]], deadband: float) -> bool:
+        if self.skipped < DEADBAND_HEARTBEAT and within_deadband(values, self.sent, deadband):
+            self.skipped += 1
+            return False
+        self.sent = list(values)
+        self.skipped = 0
+        return True
+
+
+class TuningStore:
+    """The `RuntimeConfig` shared by the scheduler and the downlink handler, persisted as JSON.
+
+    `apply()` runs on the LoRa pipeline thread, the scheduler reads `config` once per tick, so a change
+    is swapped in as a whole. The file is replaced atomically, and `refresh()` lets another process
+    (the acquisition loop in ring mode) pick up changes applied by the uplink process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.config = RuntimeConfig()
+        self.revision = 0  # incremented on every applied downlink
+        self._pending: Optional[str] = None  # confirmation for the next uplink
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def apply(self, port: int, data: bytes) -> bool:
+        """ Validates and persists a downlink, then applies it.
+
+        Args:
+            port: `int` LoRaWAN FPort of the downlink, only `TUNING_FPORT` is handled.
+            data: `bytes` of the downlink.
+        Returns:
+            `bool` whether the configuration changed, a downlink that cannot be saved is rejected.
+        """
+        if port != TUNING_FPORT:
+            return False
+        with self._lock:
+            try:
+                config = parse_downlink(self.config, data)
+            except ValueError as e:
+                print('Rejected Downlink %s: %s' % (data.hex(), e))
+                self._pending = 'R%02X' % (self.revision % 256)
+                return False
+            # persisted first, a change the acquisition process cannot read back is not applied
+            try:
+                self._save(config, self.revision + 1)
+            except (OSError, TypeError) as e:
+                print('Failed to Save Downlink %s: %s' % (data.hex(), e))
+                self._pending = 'R%02X' % (self.revision % 256)
+                return False
+            self.config = config
+            self.revision += 1
+            self._pending = 'C%02X' % (self.revision % 256)
+        print('Applied Downlink %s: %s' % (data.hex(), config))
+        return True
+
+    def confirmation(self) -> str:
+        """Suffix for the next uplink payload, 'C' or 'R' with the revision in hex, once per downlink"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending or ''
+
+    def refresh(self):
+        """Reloads the file when another process replaced it"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except (FileNotFoundError, TypeError):
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            saved = json.load(f)
+        with self._lock:
+            self.revision = saved.pop('revision', 0)
+            saved['disabled'] = frozenset(DataSource(source) for source in saved.get('disabled', []))
+            self.config = RuntimeConfig(**saved)
+            self._mtime = mtime
+
+    def _save(self, config: RuntimeConfig, revision: int):
+        saved = asdict(config)
+        saved['disabled'] = sorted(source.value for source in config.disabled)
+        saved['revision'] = revision
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(saved, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns